@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+# pylit_benchmark.py
+# ******************
+# Measure the conversion speed of pylit.py
+# ++++++++++++++++++++++++++++++++++++++++
+#
+# :Copyright: 2026 The PyLit developers.
+#             Released without warranty under the terms of the
+#             GNU General Public License (v. 2 or later)
+#
+# .. contents::
+#
+# Usage
+# =====
+#
+# ::
+#
+#   python benchmarks/pylit_benchmark.py [--scale=S] [--repeat=N] [--json=FILE]
+#
+# Every benchmark case is a corpus of code source. It is converted to text
+# (Code2Text) and the result is converted back to code (Text2Code). For both
+# directions, the best time of `repeat` runs gives the throughput in lines
+# and MB per second.
+#
+# Every measurement runs in a separate Python process (the script calls itself
+# with ``--case``), so that the peak memory use (maximum resident set size)
+# is not influenced by other cases or the generation of the corpora.
+#
+# With ``--json``, the results are written in machine-readable form (``-``
+# for standard output), to track the performance over time.
+#
+# ::
+
+"""pylit_benchmark: throughput and memory benchmarks for pylit.py"""
+
+import os, sys, time, optparse, subprocess, tempfile, shutil
+try:
+    import json
+except ImportError: # Python < 2.6
+    import simplejson as json
+try:
+    import resource
+except ImportError: # not available under Windows
+    resource = None
+
+# Use the pylit module and the contributed plug-ins from this source tree::
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(rootdir, "contribs"))
+sys.path.insert(0, rootdir)
+
+import pylit
+
+
+# Corpora
+# =======
+#
+# Synthetic code sources
+# ----------------------
+#
+# `make_code` returns a list of code lines with `blocks` pairs of a
+# documentation block (`doc_lines` commented lines ending with a code-block
+# marker) and a code block (`code_lines` lines). With `tabs`, code lines are
+# indented with hard tabs. ::
+
+def make_code(blocks, doc_lines, code_lines, comment_string="# ",
+              tabs=False):
+    """Return list of lines of a synthetic code source"""
+    lines = []
+    for i in range(blocks):
+        for j in range(doc_lines-1):
+            lines.append("%sDocumentation line %d of block %d with some "
+                         "words of text.\n" % (comment_string, j, i))
+        lines.append("%sThe code block %d follows::\n" % (comment_string, i))
+        lines.append("\n")
+        for j in range(code_lines):
+            if tabs and j % 2:
+                lines.append("\tvalue_%d = compute(%d, %d)\n" % (j, i, j))
+            else:
+                lines.append("value_%d = compute(%d, %d)\n" % (j, i, j))
+        lines.append("\n")
+    return lines
+
+# Code source with C comments (converted by `c_comment_preprocessor`)::
+
+def make_c_code(blocks, doc_lines, code_lines):
+    """Return list of lines of a synthetic C source"""
+    lines = []
+    for line in make_code(blocks, doc_lines, code_lines, "// "):
+        if line.startswith("// "):
+            line = "/* %s */\n" % line[3:].rstrip()
+        elif line.strip():
+            line = line.rstrip() + ";\n"
+        lines.append(line)
+    return lines
+
+# Emacs Lisp source with section headers (converted by the filters in
+# `pylit_elisp`)::
+
+def make_elisp_code(blocks, doc_lines, code_lines):
+    """Return list of lines of a synthetic Emacs Lisp source"""
+    lines = []
+    for line in make_code(blocks, doc_lines, code_lines, ";; "):
+        if line.startswith("value_"):
+            line = "(setq %s)\n" % line.split(" =")[0]
+        lines.append(line)
+        if line.startswith(";; Documentation line 0 "):
+            lines.append(";;; Code:\n")
+    return lines
+
+# Real sources
+# ------------
+#
+# The sources of PyLit itself, repeated `n` times::
+
+def read_source(path, n=1):
+    """Return list of lines in file at `path` (relative to rootdir)"""
+    lines = file(os.path.join(rootdir, path)).readlines()
+    return lines * max(1, n)
+
+# Benchmark cases
+# ---------------
+#
+# Every case is a pair of a function of the scale factor returning the code
+# lines and the keyword arguments for the converters::
+
+def _n(scale, number):
+    return max(1, int(number * scale))
+
+cases = {
+    "doc-heavy": (lambda scale: make_code(_n(scale, 1000), 20, 2), {}),
+    "code-heavy": (lambda scale: make_code(_n(scale, 1000), 2, 40), {}),
+    "tiny-blocks": (lambda scale: make_code(_n(scale, 10000), 1, 1), {}),
+    "huge-blocks": (lambda scale: make_code(2, _n(scale, 10000),
+                                            _n(scale, 10000)), {}),
+    "giant-blocks": (lambda scale: make_code(2, _n(scale, 200000),
+                                             _n(scale, 200000)), {}),
+    "tabs": (lambda scale: make_code(_n(scale, 1000), 2, 40, tabs=True), {}),
+    "c-filter": (lambda scale: make_c_code(_n(scale, 1000), 5, 10),
+                 {"language": "c"}),
+    "elisp-filter": (lambda scale: make_elisp_code(_n(scale, 1000), 5, 10),
+                     {"language": "elisp"}),
+    "pylit.py": (lambda scale: read_source("pylit.py", _n(scale, 20)), {}),
+    "pylit_test.py": (lambda scale: read_source("test/pylit_test.py",
+                                                _n(scale, 20)),
+                      {"comment_string": "## "}),
+    }
+
+converters = {"code2text": pylit.Code2Text,
+              "text2code": pylit.Text2Code}
+
+
+# Measurements
+# ============
+#
+# Return the best time of `repeat` conversions of `lines` with
+# `converter_class`. The output is consumed line by line (as in
+# `pylit.convert_stream`) without storing it::
+
+def time_conversion(converter_class, lines, repeat, **keyw):
+    """Return minimal time of `repeat` conversions"""
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        for line in converter_class(lines, **keyw):
+            pass
+        times.append(time.time() - start)
+    return min(times)
+
+# Return the maximum resident set size of this process in kB (or None if
+# unknown). Under Linux, `ru_maxrss` includes the memory of the parent
+# process before the child process started (the benchmark cases run in child
+# processes of the process holding the corpora), the "high water mark" of
+# the process is read from ``/proc`` instead. `ru_maxrss` is given in bytes
+# under Mac OS X and in kB elsewhere::
+
+def peak_memory():
+    try:
+        for line in file("/proc/self/status"):
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        maxrss = maxrss // 1024
+    return maxrss
+
+# Measure one conversion direction of a case with the input data from the
+# file at `path` and return a result dictionary.
+#
+# `memory_kb` is the increase of the peak memory during a conversion reading
+# the input lines from the file, i.e. the memory used by the converter (the
+# largest block). The timed conversions read the input from a list of lines
+# in memory, `peak_memory_kb` is the peak memory of the process (including
+# the interpreter and the input data)::
+
+def run_case(name, direction, path, repeat=3):
+    """Benchmark conversion of the data in `path`"""
+    keyw = cases[name][1]
+    memory_before = peak_memory()
+    stream = file(path)
+    for line in converters[direction](stream, **keyw):
+        pass
+    stream.close()
+    memory_after = peak_memory()
+    lines = file(path).readlines()
+    nbytes = os.path.getsize(path)
+    seconds = time_conversion(converters[direction], lines, repeat, **keyw)
+    result = {"case": name,
+              "direction": direction,
+              "lines": len(lines),
+              "bytes": nbytes,
+              "seconds": seconds,
+              "lines_per_sec": len(lines) / max(seconds, 1e-9),
+              "mb_per_sec": nbytes / max(seconds, 1e-9) / 2**20,
+              "peak_memory_kb": peak_memory(),
+              "memory_kb": None}
+    if memory_before is not None:
+        result["memory_kb"] = memory_after - memory_before
+    return result
+
+# Run both directions of a case in separate Python processes. The code corpus
+# and its conversion to text are generated here and written to temporary
+# files, so that the child processes only hold their input data::
+
+def run_isolated(name, scale=1.0, repeat=3):
+    """Run case `name` in child processes, return list of results"""
+    (make_corpus, keyw) = cases[name]
+    code = make_corpus(scale)
+    text = pylit.Code2Text(code, **keyw)()
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for (direction, lines) in (("code2text", code), ("text2code", text)):
+            path = os.path.join(tmpdir, direction)
+            stream = file(path, "w")
+            stream.writelines(lines)
+            stream.close()
+            args = [sys.executable, os.path.abspath(__file__),
+                    "--case", name, "--direction", direction,
+                    "--input", path, "--repeat", str(repeat), "--json", "-"]
+            child = subprocess.Popen(args, stdout=subprocess.PIPE)
+            output = child.communicate()[0]
+            if child.returncode:
+                raise RuntimeError("benchmark case %r failed" % name)
+            results.extend(json.loads(output)["results"])
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+# Reports
+# =======
+#
+# ::
+
+def report(results, stream=sys.stdout):
+    """Print a table of benchmark `results`"""
+    stream.write("%-14s %-10s %9s %12s %9s %10s\n" % ("case", "direction",
+                 "lines", "lines/s", "MB/s", "memory/kB"))
+    for result in results:
+        memory = result["memory_kb"]
+        if memory is None:
+            memory = "-"
+        stream.write("%-14s %-10s %9d %12.0f %9.2f %10s\n" % (
+                     result["case"], result["direction"], result["lines"],
+                     result["lines_per_sec"], result["mb_per_sec"], memory))
+
+# The JSON output also records the Python and PyLit versions::
+
+def write_json(results, stream):
+    data = {"python": sys.version.split()[0],
+            "pylit": pylit._version,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results}
+    json.dump(data, stream, indent=1, sort_keys=True)
+    stream.write("\n")
+
+
+# main
+# ====
+#
+# ::
+
+def main(args=sys.argv[1:]):
+    """%prog [options] [CASE ...]
+
+    Benchmark the pylit text <-> code conversion.
+    Default: run all cases (see --list).
+    """
+    p = optparse.OptionParser(usage=main.__doc__)
+    p.add_option("--scale", type="float", default=1.0,
+                 help="scale factor for the size of the corpora")
+    p.add_option("--repeat", type="int", default=3,
+                 help="number of runs per measurement (best is taken)")
+    p.add_option("--json", metavar="FILE",
+                 help="write results as JSON to FILE ('-' for stdout)")
+    p.add_option("--list", action="store_true",
+                 help="list the benchmark cases and exit")
+    p.add_option("--case", help="run CASE in this process (internal)")
+    p.add_option("--direction", choices=converters.keys(),
+                 help="conversion direction for --case (internal)")
+    p.add_option("--input", help="input data for --case (internal)")
+    (options, names) = p.parse_args(args)
+
+    if options.list:
+        for name in sorted(cases):
+            print name
+        return
+
+    if options.case:
+        results = [run_case(options.case, options.direction, options.input,
+                            options.repeat)]
+    else:
+        names = names or sorted(cases)
+        for name in names:
+            if name not in cases:
+                p.error("unknown benchmark case %r" % name)
+        results = []
+        for name in names:
+            results.extend(run_isolated(name, options.scale, options.repeat))
+
+    if options.json == "-":
+        write_json(results, sys.stdout)
+        return
+    if options.json:
+        stream = file(options.json, "w")
+        write_json(results, stream)
+        stream.close()
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+# startup_benchmark.py
+# ********************
+# Measure the start-up time of pylit.py
+# +++++++++++++++++++++++++++++++++++++
+#
+# :Copyright: 2026 The PyLit developers.
+#             Released without warranty under the terms of the
+#             GNU General Public License (v. 2 or later)
+#
+# .. contents::
+#
+# Usage
+# =====
+#
+# ::
+#
+#   python benchmarks/startup_benchmark.py [--repeat=N] [--json=FILE]
+#
+# PyLit is often called for single small files (e.g. from version control
+# hooks or editors), where the start-up time of the Python process and the
+# import of pylit dominate the run time. Every case runs a command in a new
+# Python process, the best wall-clock time of `repeat` runs is reported
+# together with the overhead compared to starting the bare interpreter.
+#
+# The commands run with a copy of pylit.py in a temporary directory, so that
+# the byte-code cache does not change the source tree.
+#
+# ::
+
+"""startup_benchmark: start-up time of pylit.py runs"""
+
+import os, sys, time, optparse, subprocess, tempfile, shutil, py_compile
+try:
+    import json
+except ImportError: # Python < 2.6
+    import simplejson as json
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Cases
+# =====
+#
+# Every case is a list of arguments for the Python interpreter. The
+# placeholders ``{pylit}`` and ``{infile}`` are replaced by the paths of the
+# pylit.py copy and a small code source:
+#
+# :python:   start and exit the interpreter (baseline),
+# :import:   import the pylit module,
+# :script:   convert with the pylit.py script,
+# :module:   convert with ``python -m pylit``,
+# :wrapper:  convert with a wrapper script importing pylit,
+# :options:  convert with the wrapper and a command line option (sets up the
+#            option parser).
+#
+# Only the module import uses the byte-code cache. A script is compiled on
+# every run, and so is a module run with ``python -m`` under Python 2.
+# ::
+
+wrapper = "import pylit; pylit.main()"
+
+cases = [("python", ["-c", "pass"]),
+         ("import", ["-c", "import pylit"]),
+         ("script", ["{pylit}", "{infile}", "-"]),
+         ("module", ["-m", "pylit", "{infile}", "-"]),
+         ("wrapper", ["-c", wrapper, "{infile}", "-"]),
+         ("options", ["-c", wrapper, "--codeindent=4", "{infile}", "-"]),
+        ]
+
+# A small code source with some documentation blocks::
+
+def make_code(blocks=10):
+    """Return list of lines of a small code source"""
+    lines = []
+    for i in range(blocks):
+        lines.append("# Documentation of block %d::\n\n" % i)
+        lines.append("value_%d = %d\n\n" % (i, i))
+    return lines
+
+
+# Measurements
+# ============
+#
+# Return the best times of `repeat` runs of the interpreter with every
+# argument list in `commands`. The commands run in turn, so that changes of
+# the system load affect all of them alike. The output is discarded::
+
+def time_commands(commands, repeat, env):
+    """Return list of minimal wall-clock times of the `commands`"""
+    devnull = file(os.devnull, "w")
+    times = [[] for args in commands]
+    try:
+        for i in range(repeat):
+            for (args, command_times) in zip(commands, times):
+                start = time.time()
+                returncode = subprocess.call([sys.executable] + args,
+                                             stdout=devnull, env=env)
+                command_times.append(time.time() - start)
+                if returncode:
+                    raise RuntimeError("command %r failed" % args)
+    finally:
+        devnull.close()
+    return [min(command_times) for command_times in times]
+
+# Set up the temporary directory, run the cases with `names` and return a list
+# of result dictionaries::
+
+def run_cases(names, repeat=20):
+    """Measure the start-up time of the cases `names`"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        pylit = os.path.join(tmpdir, "pylit.py")
+        shutil.copy(os.path.join(rootdir, "pylit.py"), pylit)
+        py_compile.compile(pylit)
+        infile = os.path.join(tmpdir, "example.py")
+        stream = file(infile, "w")
+        stream.writelines(make_code())
+        stream.close()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = tmpdir
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        selected = [(name, [arg.replace("{pylit}", pylit)
+                                .replace("{infile}", infile) for arg in args])
+                    for (name, args) in cases if name in names]
+        seconds = time_commands([args for (name, args) in selected],
+                                repeat, env)
+        results = [{"case": name, "seconds": best}
+                   for ((name, args), best) in zip(selected, seconds)]
+    finally:
+        shutil.rmtree(tmpdir)
+    baseline = [result["seconds"] for result in results
+                if result["case"] == "python"]
+    for result in results:
+        if baseline:
+            result["overhead"] = result["seconds"] - baseline[0]
+        else:
+            result["overhead"] = None
+    return results
+
+
+# Reports
+# =======
+#
+# ::
+
+def report(results, stream=sys.stdout):
+    """Print a table of benchmark `results`"""
+    stream.write("%-10s %10s %12s\n" % ("case", "time/ms", "overhead/ms"))
+    for result in results:
+        overhead = result["overhead"]
+        if overhead is None:
+            overhead = "-"
+        else:
+            overhead = "%.1f" % (overhead * 1000)
+        stream.write("%-10s %10.1f %12s\n" % (
+                     result["case"], result["seconds"] * 1000, overhead))
+
+# The JSON output also records the Python version::
+
+def write_json(results, stream):
+    data = {"python": sys.version.split()[0],
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results}
+    json.dump(data, stream, indent=1, sort_keys=True)
+    stream.write("\n")
+
+
+# main
+# ====
+#
+# ::
+
+def main(args=sys.argv[1:]):
+    """%prog [options] [CASE ...]
+
+    Benchmark the start-up time of pylit runs.
+    Default: run all cases (see --list).
+    """
+    p = optparse.OptionParser(usage=main.__doc__)
+    p.add_option("--repeat", type="int", default=20,
+                 help="number of runs per case (best is taken)")
+    p.add_option("--json", metavar="FILE",
+                 help="write results as JSON to FILE ('-' for stdout)")
+    p.add_option("--list", action="store_true",
+                 help="list the benchmark cases and exit")
+    (options, names) = p.parse_args(args)
+
+    all_names = [name for (name, args) in cases]
+    if options.list:
+        for name in all_names:
+            print name
+        return
+    for name in names:
+        if name not in all_names:
+            p.error("unknown benchmark case %r" % name)
+
+    results = run_cases(names or all_names, options.repeat)
+
+    if options.json == "-":
+        write_json(results, sys.stdout)
+        return
+    if options.json:
+        stream = file(options.json, "w")
+        write_json(results, stream)
+        stream.close()
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
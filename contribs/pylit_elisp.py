@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+# pylit-extensions: .el
 
 # ===============================================================
 # pylit_elisp.py: Settings and filters for elisp conversion
@@ -25,6 +26,9 @@
 # :0.3: * Rewrite filter as iterator generators, the filter interface is 
 #         moved to pylit.py(GM)
 #       * require three semicolons (``;;;``) in section header regexp
+# :0.4: * line-wise filters (`pylit.line_filter`), registered with
+#         `pylit.register_language`
+#       * loaded on demand as PyLit plug-in (see `pylit.load_plugin`)
 # ::
 
 """Emacs lisp for the PyLit code<->text converter.
@@ -34,7 +38,7 @@ Defaults and filters for elisp (emacs lisp) code
 
 __docformat__ = 'restructuredtext'
 
-_version = "0.3"
+_version = "0.4"
 
 
 # Requirements
@@ -50,10 +54,19 @@ import pylit
 # Emacs Lisp filters
 # ==================
 # 
-# 
+# Both filters change single lines. They are written as line functions and
+# wrapped with `pylit.line_filter`, so that PyLit can fuse them with other
+# line-wise filters.
+#
+# Regular expression matching the special ELisp headers::
+
+SECTION_PATTERN = \
+    re.compile(';;; *(Change *Log|Code|Commentary|Documentation|History):',\
+                   re.IGNORECASE)
+
 # ::
 
-def elisp_code_preprocessor(data):
+def elisp_code_preprocessor(line):
     """Convert Emacs Lisp comment sectioning markers to reST comments.
 
     The special headers listed at:
@@ -79,22 +92,16 @@ def elisp_code_preprocessor(data):
       (defun my-elisp-function () ...)
     """
 
-# Regular expression matching the special ELisp headers::
-
-    SECTION_PATTERN = \
-        re.compile(';;; *(Change *Log|Code|Commentary|Documentation|History):',\
-                       re.IGNORECASE)
-
-# Prepend ``.. |elisp> `` to matching headers, one line at a time::
+# Prepend ``.. |elisp> `` to matching headers::
     
-    for line in data:
-        if SECTION_PATTERN.match(line):
-            yield pylit.defaults.comment_strings["elisp"] + '.. |elisp> ' + line
-        else:
-            yield line
+    if SECTION_PATTERN.match(line):
+        return pylit.defaults.comment_strings["elisp"] + '.. |elisp> ' + line
+    return line
+
+elisp_code_preprocessor = pylit.line_filter(elisp_code_preprocessor)
 
 
-def elisp_code_postprocessor(data):
+def elisp_code_postprocessor(line):
     """Convert specially-marked reST comments to Emacs Lisp code.
 
     In all lines, the prefix ``.. |elisp> `` (note
@@ -113,14 +120,15 @@ def elisp_code_postprocessor(data):
       (another-one)
     """
     
-    # Set the prefix to be stripped
+    # Set the prefix to be stripped (only if the line can contain it)
+    if '.. |elisp> ' not in line:
+        return line
     prefix = pylit.defaults.comment_strings["elisp"] + '.. |elisp> '
-    
-    for line in data:
-        if line.startswith(prefix):
-            yield line[len(prefix):]
-        else:
-            yield line
+    if line.startswith(prefix):
+        return line[len(prefix):]
+    return line
+
+elisp_code_postprocessor = pylit.line_filter(elisp_code_postprocessor)
 
 
 
@@ -134,10 +142,7 @@ def elisp_code_postprocessor(data):
 # 
 # ::
 
-pylit.defaults.languages[".el"] = "elisp"
-pylit.defaults.comment_strings["elisp"] = ';; '
-
-# Filters
-pylit.defaults.preprocessors["elisp2text"] = elisp_code_preprocessor
-pylit.defaults.postprocessors["text2elisp"] = elisp_code_postprocessor
+pylit.register_language("elisp", extensions=[".el"], comment_string=';; ',
+                        preprocessors=[elisp_code_preprocessor],
+                        postprocessors=[elisp_code_postprocessor])
 
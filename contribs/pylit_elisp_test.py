@@ -89,8 +89,8 @@ def test_elisp_code_postprocessor():
 def test_elisp_settings():
     assert defaults.languages[".el"] == "elisp"
     assert defaults.comment_strings["elisp"] == ';; '
-    assert defaults.preprocessors["elisp2text"] == elisp_code_preprocessor
-    assert defaults.postprocessors["text2elisp"] == elisp_code_postprocessor
+    assert defaults.preprocessors["elisp2text"] == [elisp_code_preprocessor]
+    assert defaults.postprocessors["text2elisp"] == [elisp_code_postprocessor]
 
 def test_elisp2text():
     for key in code.keys():
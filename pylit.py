@@ -108,6 +108,63 @@ and *source code* with embedded documentation.
 # 0.7.8   2011-03-30  bugfix: do not overwrite custom `add_missing_marker` value,
 #                     allow directive options following the 'code' directive.
 # 0.7.9   2011-04-05  Decode doctest string if 'magic comment' gives encoding.
+#         2026-10-18  New command line option --recursive: convert all
+#                     literate sources below a directory in one process,
+#                     new functions `find_sources`_, `convert_file`_ and
+#                     `convert_many`_.
+#         2026-10-18  New command line option --jobs: convert in parallel
+#                     processes.
+#         2026-10-18  New command line option --cache-dir: skip conversion
+#                     if input and settings are unchanged (`ConversionCache`_).
+#         2026-10-18  Write converted lines incrementally (`convert_stream`_).
+#         2026-10-18  New command line option --mmap: read input files
+#                     with `MappedFile`_, `expandtabs_filter`_ only copies
+#                     lines containing a tab.
+#         2026-10-18  `tokenize_blocks`_ combines `expandtabs_filter`_ and
+#                     `collect_blocks`_ and precomputes the line indents used
+#                     by `set_state` and the handlers.
+#         2026-10-18  Cache compiled regular expressions and filters of
+#                     a converter configuration in a `Dialect`_.
+#         2026-10-18  New command line option --profile, timing of the
+#                     conversion stages with a `Profiler`_.
+#         2026-10-18  New command line option --watch: keep text and code
+#                     versions in sync (`Watcher`_).
+#         2026-10-18  Import literate Python modules (``foo.py.txt``) with
+#                     the `LiterateImporter`_, bytecode cache in
+#                     `compile_text`_.
+#         2026-10-18  --execute runs the code in a fresh ``__main__``
+#                     namespace, text sources are compiled with
+#                     `compile_text`_ (cached with --cache-dir, tracebacks
+#                     show the filename).
+#         2026-10-18  --doctest accepts many files and directories, new
+#                     function `run_doctests`_ (parallel, with timeouts),
+#                     new command line options --timeout and --junit-xml.
+#         2026-10-18  With --cache-dir, --doctest skips files that passed
+#                     before and did not change (`doctest cache`_).
+#         2026-10-18  New command line option --check: test if output files
+#                     are up to date without a full diff (`check`_).
+#         2026-10-18  New command line option --verify: block-wise
+#                     round-trip test (`verify_roundtrip`_), also used by
+#                     `diff`_ if there is no output file.
+#         2026-10-18  New command line options --serve and --socket: JSON-RPC
+#                     `conversion server`_ for editors.
+#         2026-10-18  Line number map between input and output of a
+#                     conversion (`SourceMap`_), new command line option
+#                     --source-map.
+#         2026-10-18  Block-wise re-conversion of edited documents
+#                     (`IncrementalConverter`_).
+#         2026-10-18  A `Block`_ stores its lines in one string.
+#         2026-10-18  `c_comment_preprocessor`_ and `c_comment_postprocessor`_
+#                     (multi-line comments, string literals) replace the
+#                     dumb_c filters for C and CSS.
+#         2026-10-18  Lists of filters (`FilterChain`_) with fused
+#                     `line_filter`\ s, `register_language`_.
+#         2026-10-18  Lazy loading of language `plug-ins`_ (entry points,
+#                     plug-in path).
+#         2026-10-18  Faster start-up: `Values`_ replaces `optparse.Values`,
+#                     the option parser is only set up for options.
+#         2026-10-18  Atomic output files (`AtomicFile`_), new command line
+#                     options --no-atomic, --buffer-size and --fsync.
 # ======  ==========  ===========================================================
 #
 # ::
@@ -135,7 +192,9 @@ __docformat__ = 'restructuredtext'
 # ::
 
 import __builtin__, os, sys
-import re, optparse
+import re
+from itertools import izip, count
+from array import array
 
 
 # DefaultDict
@@ -155,13 +214,43 @@ class DefaultDict(dict):
         return self.get(key, self.default)
 
 
+# .. _Values:
+#
+# Values
+# ------
+#
+# A minimal replacement for `optparse.Values`, an object holding option values
+# as attributes. Importing `optparse` takes a considerable part of the
+# start-up time of a pylit run. With `Values`, it is only imported if the
+# command line has options (see `PylitOptions.parser`_). ::
+
+class Values(object):
+    """Container for option values (compatible to `optparse.Values`)"""
+
+    def __init__(self, defaults=None):
+        if defaults:
+            self.__dict__.update(defaults)
+
+    def __str__(self):
+        return str(self.__dict__)
+
+    def __repr__(self):
+        return "<%s at 0x%x: %s>" % (self.__class__.__name__, id(self), self)
+
+    def ensure_value(self, attr, value):
+        """Set `attr` to `value` if it is missing or None, return `attr`"""
+        if getattr(self, attr, None) is None:
+            setattr(self, attr, value)
+        return getattr(self, attr)
+
+
 # Defaults
 # ========
 #
 # The `defaults` object provides a central repository for default
 # values and their customisation. ::
 
-defaults = optparse.Values()
+defaults = Values()
 
 # It is used for
 #
@@ -318,8 +407,10 @@ defaults.add_missing_marker = True
 # preprocessors
 # -------------
 #
-# Preprocess the data with language-specific filters_
-# Set below in Filters_::
+# Preprocess the data with language-specific filters_. The value for a key
+# is a filter or a list of filters that are applied in order (see
+# `FilterChain`_).
+# Set below in Filters_ and with `register_language`_::
 
 defaults.preprocessors = {}
 
@@ -358,16 +449,64 @@ defaults.overwrite = 'update'
 #  :'update': fail if the `outfile` is newer than `infile`,
 #  :'no':     fail if `outfile` exists.
 #
+# .. _defaults.atomic:
+#
+# atomic
+# ------
+#
+# Write output files via a temporary file that replaces `outfile` when the
+# conversion is complete (see AtomicFile_). A failing conversion leaves an
+# existing `outfile` unchanged::
+
+defaults.atomic = True
+
+# buffer_size
+# -----------
+#
+# Buffer size for writing output files in bytes (``-1``: system default)::
+
+defaults.buffer_size = 2**16
+
+# fsync
+# -----
+#
+# Flush atomically written output files to disk before they replace
+# `outfile`. This makes sure the new content survives a system crash, but
+# costs time::
+
+defaults.fsync = False
+
+# .. _defaults.cache_dir:
+#
+# cache_dir
+# ---------
+#
+# Directory for the `ConversionCache`_ (``None`` disables caching)::
+
+defaults.cache_dir = None
+
+# With a cache, an output file is only rewritten if its content differs from
+# the cached conversion of the (unchanged) input. This makes the conversion
+# independent of modification times that are reset by version control
+# checkouts or ``touch``.
 #
-# Extensions
-# ==========
+# .. _defaults.plugins:
+#
+# plugins
+# -------
 #
-# Try to import optional extensions::
+# Language plug-ins by language or file extension. A plug-in is a module
+# name or the path of a Python file. It is imported by `load_plugin`_ when
+# its language or extension is used for the first time::
 
-try:
-    import pylit_elisp
-except ImportError:
-    pass
+defaults.plugins = {"elisp": "pylit_elisp",
+                    ".el":   "pylit_elisp"}
+
+# More plug-ins are found with `discover_plugins`_ (setuptools entry points
+# and files in the `plugin_path`)::
+
+defaults.plugin_path = filter(None, os.environ.get("PYLIT_PLUGIN_PATH",
+                                                  "").split(os.pathsep))
 
 
 # Converter Classes
@@ -414,6 +553,9 @@ class TextCodeConverter(object):
     strip_marker = defaults.strip_marker
     add_missing_marker = defaults.add_missing_marker
     directive_option_regexp = re.compile(r' +:(\w|[-._+:])+:( |$)')
+    dialect = None # set in __init__ (if None), see Dialect_
+    profiler = None # timing hooks, see Profiler_
+    source_map = None # record line numbers, see SourceMap_
     state = "" # type of current block, see `TextCodeConverter.convert`_
 
 # Interface methods
@@ -446,34 +588,26 @@ class TextCodeConverter(object):
         self.data = data
         self.__dict__.update(keyw)
 
-# If empty, `code_block_marker` and `comment_string` are set according
-# to the `language`::
-
-        if not self.code_block_marker:
-            self.code_block_marker = self.code_block_markers[self.language]
-        if not self.comment_string:
-            self.comment_string = self.comment_strings[self.language]
-        self.stripped_comment_string = self.comment_string.rstrip()
-
-# Pre- and postprocessing filters are set (with
-# `TextCodeConverter.get_filter`_)::
+# If no `dialect` is given, `code_block_marker` and `comment_string` are set
+# according to the `language` (if empty) and the matching Dialect_ is fetched
+# with `get_dialect`_::
 
-        self.preprocessor = self.get_filter("preprocessors", self.language)
-        self.postprocessor = self.get_filter("postprocessors", self.language)
+        if self.dialect is None:
+            if self.language not in self.comment_strings:
+                load_plugin(self.language)
+            if not self.code_block_marker:
+                self.code_block_marker = self.code_block_markers[self.language]
+            if not self.comment_string:
+                self.comment_string = self.comment_strings[self.language]
+            self.dialect = get_dialect(self.__class__, self.language,
+                                       self.comment_string,
+                                       self.code_block_marker)
 
-# .. _inserted into a regular expression:
-#
-# Finally, a regular_expression for the `code_block_marker` is compiled
-# to find valid cases of `code_block_marker` in a given line and return
-# the groups: ``\1 prefix, \2 code_block_marker, \3 remainder`` ::
+# The dialect provides the settings that depend on the language, comment
+# string and code-block marker, i.e. the pre- and postprocessing filters and
+# the compiled regular expression for the `code_block_marker`::
 
-        marker = self.code_block_marker
-        if marker == '::':
-            # the default marker may occur at the end of a text line
-            self.marker_regexp = re.compile('^( *(?!\.\.).*)(::)([ \n]*)$')
-        else:
-            # marker must be on a separate line
-            self.marker_regexp = re.compile('^( *)(%s)(.*\n?)$' % marker)
+        self.__dict__.update(self.dialect.__dict__)
 
 # .. _TextCodeConverter.__iter__:
 #
@@ -493,12 +627,22 @@ class TextCodeConverter(object):
 # language are registered in `defaults.preprocessors`_ and|or
 # `defaults.postprocessors`_. The filters must accept an iterable as first
 # argument and yield the processed input data line-wise.
+#
+# If a `profiler` is set, every stage of the chain is timed with it (see
+# Profiler_).
 # ::
 
     def __iter__(self):
         """Iterate over input data source and yield converted lines
         """
-        return self.postprocessor(self.convert(self.preprocessor(self.data)))
+        profiler = self.profiler
+        if profiler is None:
+            return self.postprocessor(
+                            self.convert(self.preprocessor(self.data)))
+        data = profiler.iterate("read", self.data)
+        data = profiler.iterate("preprocessor", self.preprocessor(data))
+        data = profiler.iterate("convert", self.convert(data))
+        return profiler.iterate("postprocessor", self.postprocessor(data))
 
 
 # .. _TextCodeConverter.__call__:
@@ -522,6 +666,10 @@ class TextCodeConverter(object):
     def __str__(self):
         return "".join(self())
 
+# Both, `__call__` and `__str__` hold the complete output in memory. To write
+# the converted data without this overhead, iterate over the instance (see
+# `convert_stream`_).
+
 
 # Helpers and convenience methods
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -594,12 +742,40 @@ class TextCodeConverter(object):
 
 
 
-# Determine the state of the block and convert with the matching "handler"::
+# Determine the state of the block and convert with the matching "handler".
+# The blocks are collected by `tokenize_blocks`_, which also expands tabs and
+# records the indentation of every line. The lines of a block are released
+# after its conversion (see Block_)::
+
+        profiler = self.profiler
+        source_map = self.source_map
+        if profiler is None and source_map is None:
+            for block in tokenize_blocks(lines):
+                self.set_state(block)
+                for line in getattr(self, self.state+"_handler")(block):
+                    yield line
+                block.release()
+            return
 
-        for block in collect_blocks(expandtabs_filter(lines)):
-            self.set_state(block)
-            for line in getattr(self, self.state+"_handler")(block):
+# The same with timing of the individual steps and recording of the number of
+# input and output lines of every block::
+
+        if profiler is None:
+            profiler = _no_profiler
+        if source_map is not None:
+            source_map.clear()
+        for block in profiler.iterate("tokenize_blocks",
+                                      tokenize_blocks(lines)):
+            profiler.call("set_state", self.set_state, block)
+            handler = self.state+"_handler"
+            output_lines = 0
+            for line in profiler.iterate(handler,
+                                         getattr(self, handler)(block)):
+                output_lines += 1
                 yield line
+            block.release()
+            if source_map is not None:
+                source_map.add(len(block), output_lines)
 
 
 # .. _TextCodeConverter.get_filter:
@@ -610,18 +786,7 @@ class TextCodeConverter(object):
 
     def get_filter(self, filter_set, language):
         """Return language specific filter"""
-        if self.__class__ == Text2Code:
-            key = "text2"+language
-        elif self.__class__ == Code2Text:
-            key = language+"2text"
-        else:
-            key = ""
-        try:
-            return getattr(defaults, filter_set)[key]
-        except (AttributeError, KeyError):
-            # print "there is no %r filter in %r"%(key, filter_set)
-            pass
-        return identity_filter
+        return _get_filter(self.__class__, filter_set, language)
 
 
 # get_indent
@@ -633,6 +798,20 @@ class TextCodeConverter(object):
         """
         return len(line) - len(line.lstrip())
 
+# line_indents
+# """"""""""""
+# Return the indentation of every line in `lines` (``None`` for blank lines).
+# A `Block`_ from `tokenize_blocks`_ carries precomputed values, other
+# sequences of lines are evaluated here::
+
+    def line_indents(self, lines):
+        """Return list of line indents (None for blank lines)
+        """
+        try:
+            return lines.indents
+        except AttributeError:
+            return [_line_indent(line) for line in lines]
+
 
 # Text2Code
 # ---------
@@ -702,8 +881,8 @@ class Text2Code(TextCodeConverter):
 # preceding documentation block::
 
         elif self.state in ["code_block", "header"]:
-            indents = [self.get_indent(line) for line in block
-                       if line.rstrip()]
+            indents = [indent for indent in self.line_indents(block)
+                       if indent is not None]
             # print "set_state:", indents, self._textindent
             if indents and min(indents) <= self._textindent:
                 self.state = 'documentation'
@@ -766,7 +945,7 @@ class Text2Code(TextCodeConverter):
 
     def header_handler(self, lines):
         """Format leading code block"""
-        # strip header string from first line
+        # strip header string from first line (updates the indents of a Block)
         lines[0] = lines[0].replace(self.header_string, "", 1)
         # yield remaining lines formatted as code-block
         for line in self.code_block_handler(lines):
@@ -793,9 +972,9 @@ class Text2Code(TextCodeConverter):
     def documentation_handler(self, lines):
         """Convert documentation blocks from text to code format
         """
-        for line in lines:
+        for (line, indent) in izip(lines, self.line_indents(lines)):
             # test lines following the code-block marker for false positives
-            if (self.state == "code_block" and line.rstrip()
+            if (self.state == "code_block" and indent is not None
                 and not self.directive_option_regexp.search(line)):
                 self.state = "documentation"
             # test for end of documentation block
@@ -806,7 +985,7 @@ class Text2Code(TextCodeConverter):
             if self.strip:
                 continue
             # do not comment blank lines preceding a code block
-            if self.state == "code_block" and not line.rstrip():
+            if self.state == "code_block" and indent is None:
                 yield line
             else:
                 yield self.comment_string + line
@@ -831,14 +1010,15 @@ class Text2Code(TextCodeConverter):
 # If still unset, determine the indentation of code blocks from first non-blank
 # code line::
 
+        indents = self.line_indents(block)
         if self._codeindent == 0:
             self._codeindent = self.get_indent(block[0])
 
 # Yield unindented lines after check whether we can safely unindent. If the
 # line is less indented then `_codeindent`, something got wrong. ::
 
-        for line in block:
-            if line.lstrip() and self.get_indent(line) < self._codeindent:
+        for (line, indent) in izip(block, indents):
+            if indent is not None and indent < self._codeindent:
                 raise ValueError, "code block contains line less indented " \
                       "than %d spaces \n%r"%(self._codeindent, block)
             yield line.replace(" "*self._codeindent, "", 1)
@@ -870,11 +1050,11 @@ class Code2Text(TextCodeConverter):
 
     def set_state(self, block):
         """Determine state of `block`."""
-        for line in block:
+        for (line, indent) in izip(block, self.line_indents(block)):
             # skip documentation lines (commented, blank or blank comment)
             if (line.startswith(self.comment_string)
-                or not line.rstrip()
-                or line.rstrip() == self.comment_string.rstrip()
+                or indent is None
+                or line.rstrip() == self.stripped_comment_string
                ):
                 continue
             # non-commented line found:
@@ -1025,6 +1205,347 @@ class Code2Text(TextCodeConverter):
         else:                         # '::' follows text
             lines[-2] = match.group(1).rstrip() + ':' + match.group(3)
 
+# .. _Profiler:
+#
+# Profiler
+# ========
+#
+# A `Profiler` measures where the time of a conversion is spent. If a
+# converter has a `profiler`, `TextCodeConverter.__iter__`_ and
+# `TextCodeConverter.convert`_ run every stage of the conversion through one of
+# its hook methods:
+#
+# ``call(stage, function, *args)``
+#   call `function` with `args`, e.g. `set_state`, or the final ``write``
+#   in `convert_stream`_,
+#
+# ``iterate(stage, iterable)``
+#   iterate over the lines or blocks of a stage: ``read`` (the input
+#   data), ``preprocessor``, ``tokenize_blocks``, ``<state>_handler``,
+#   ``convert`` (the state machine) and ``postprocessor``.
+#
+# Any object providing these two methods can be used as hook, e.g. for
+# logging.
+#
+# The stages form a chain of nested iterators. The `Profiler` counts the time
+# spent in a stage *exclusive* of the time spent in the stages it calls, so
+# that e.g. the time of a slow preprocessing filter is not attributed to the
+# state machine. Call counts are the number of calls (or yielded items).
+# ::
+
+class Profiler(object):
+    """Collect call counts and exclusive times of conversion stages
+    """
+    def __init__(self, timer=None):
+        if timer is None:
+            import time
+            timer = time.time
+        self.timer = timer
+        self.stats = {}   # stage -> [calls, seconds]
+        self._stack = []  # time spent in called stages (per active stage)
+
+    def _start(self):
+        self._stack.append(0.0)
+        return self.timer()
+
+    def _stop(self, stage, start, count=1):
+        elapsed = self.timer() - start
+        inner = self._stack.pop()
+        if self._stack:
+            self._stack[-1] += elapsed
+        record = self.stats.setdefault(stage, [0, 0.0])
+        record[0] += count
+        record[1] += elapsed - inner
+
+    def call(self, stage, function, *args, **keyw):
+        """Call `function` and add the time to `stage`"""
+        start = self._start()
+        try:
+            return function(*args, **keyw)
+        finally:
+            self._stop(stage, start)
+
+    def iterate(self, stage, iterable):
+        """Iterate over `iterable`, adding the time to `stage`"""
+        iterator = iter(iterable)
+        while True:
+            start = self._start()
+            try:
+                item = iterator.next()
+            except StopIteration:
+                self._stop(stage, start, 0)
+                return
+            except:
+                self._stop(stage, start, 0)
+                raise
+            self._stop(stage, start)
+            yield item
+
+# Write a table of the stages sorted by time::
+
+    def report(self, stream=sys.stderr):
+        """Write the collected statistics to `stream`"""
+        total = sum([seconds for (calls, seconds) in self.stats.values()])
+        items = [(seconds, stage, calls)
+                 for (stage, (calls, seconds)) in self.stats.items()]
+        items.sort()
+        items.reverse()
+        stream.write("%-24s %10s %10s %6s\n" % ("stage", "calls",
+                                                 "seconds", "%"))
+        for (seconds, stage, calls) in items:
+            stream.write("%-24s %10d %10.4f %6.1f\n" % (stage, calls, seconds,
+                         100.0 * seconds / (total or 1)))
+
+
+# A hook object that does nothing (used if only a `source_map` is recorded)::
+
+class _NoProfiler(object):
+    def call(self, stage, function, *args, **keyw):
+        return function(*args, **keyw)
+    def iterate(self, stage, iterable):
+        return iterable
+
+_no_profiler = _NoProfiler()
+
+
+# .. _SourceMap:
+#
+# SourceMap
+# =========
+#
+# Text and code source of a document usually have the same number of lines.
+# This is no longer true if documentation or code is stripped (`strip`_,
+# `strip_marker`_) or a missing code block marker is added
+# (`add_missing_marker`_). A `SourceMap` translates line numbers between the
+# input and the output of a conversion, e.g. to find the line in the text
+# source for a traceback from the code.
+#
+# A converter records the map, if its `source_map` attribute is a `SourceMap`
+# instance. The map is a list of segments ``[input lines, output lines]``,
+# one for every block. Adjacent blocks with equal number of input and output
+# lines are joined in one segment. The string representation is compact,
+# e.g. ``"40,3:0,12"`` for 40 lines mapped one to one, 3 stripped lines and
+# 12 more lines mapped one to one.
+#
+# Inside a block, lines are matched by position. The handlers add lines at
+# the start of a block (the code block marker) and strip lines at the end
+# (stripped code block marker), hence a block with more output lines is
+# aligned at the end and a block with less output lines at the start. Lines
+# that have no counterpart are translated to None. ::
+
+class SourceMap(object):
+    """Map line numbers between input and output of a conversion"""
+
+    def __init__(self, segments=None):
+        self.segments = segments or []
+
+    def clear(self):
+        self.segments = []
+
+    def add(self, input_lines, output_lines):
+        """Append a block with `input_lines` and `output_lines`"""
+        if (input_lines == output_lines and self.segments
+            and self.segments[-1][0] == self.segments[-1][1]):
+            self.segments[-1][0] += input_lines
+            self.segments[-1][1] += output_lines
+        elif input_lines or output_lines:
+            self.segments.append([input_lines, output_lines])
+
+    def __str__(self):
+        return ",".join([inp == out and str(inp) or "%d:%d" % (inp, out)
+                         for (inp, out) in self.segments])
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "SourceMap(%r)" % str(self)
+
+# Create a `SourceMap` from its string representation::
+
+    def parse(cls, string):
+        """Return SourceMap from string representation"""
+        segments = []
+        for item in string.split(","):
+            if item.strip():
+                counts = [int(count) for count in item.split(":")]
+                segments.append([counts[0], counts[-1]])
+        return cls(segments)
+    parse = classmethod(parse)
+
+# Translate line numbers (starting with 1)::
+
+    def to_output(self, lineno):
+        """Return output line number for input line `lineno` (or None)"""
+        return self._translate(lineno, True)
+
+    def to_input(self, lineno):
+        """Return input line number for output line `lineno` (or None)"""
+        return self._translate(lineno, False)
+
+    def _translate(self, lineno, forward):
+        (start, target) = (0, 0)
+        for (input_lines, output_lines) in self.segments:
+            if forward:
+                (size, target_size) = (input_lines, output_lines)
+            else:
+                (size, target_size) = (output_lines, input_lines)
+            if lineno <= start + size:
+                offset = lineno - start - 1
+                if offset < 0 or not target_size:
+                    return None
+                if output_lines >= input_lines: # aligned at the end
+                    offset += target_size - size
+                    if offset < 0: # added line
+                        return None
+                elif offset >= target_size: # stripped line
+                    return None
+                return target + offset + 1
+            start += size
+            target += target_size
+        return None
+
+# Return the number of output lines for the first `offset` input lines, i.e.
+# translate the position of a block boundary. Inside a segment, the
+# alignment rules for lines apply::
+
+    def output_offset(self, offset):
+        """Return output line offset for input line offset `offset`"""
+        (start, target) = (0, 0)
+        for (input_lines, output_lines) in self.segments:
+            if offset <= start:
+                break
+            if offset < start + input_lines:
+                rest = start + input_lines - offset
+                if output_lines >= input_lines: # aligned at the end
+                    return target + output_lines - rest
+                return target + min(offset - start, output_lines)
+            start += input_lines
+            target += output_lines
+        return target + max(offset - start, 0)
+
+
+# .. _Dialect:
+#
+# Dialects
+# ========
+#
+# A `Dialect` holds the settings of a converter class that are derived from
+# `language`, `comment_string` and `code_block_marker`:
+#
+# * the compiled regular expression for the `code_block_marker`,
+# * the comment string without trailing whitespace,
+# * the pre- and postprocessing filters.
+#
+# Computing these settings (especially compiling the regular expression) is
+# the main part of the setup cost of a converter. A dialect is built once for
+# every configuration and shared by all converters using it. ::
+
+class Dialect(object):
+    """Language dependent settings of a converter class
+    """
+    def __init__(self, converter_class, language, comment_string,
+                 code_block_marker):
+        self.language = language
+        self.comment_string = comment_string
+        self.stripped_comment_string = comment_string.rstrip()
+        self.code_block_marker = code_block_marker
+
+# Pre- and postprocessing filters are set with `_get_filter`::
+
+        self.preprocessor = _get_filter(converter_class,
+                                        "preprocessors", language)
+        self.postprocessor = _get_filter(converter_class,
+                                         "postprocessors", language)
+
+# .. _inserted into a regular expression:
+#
+# Finally, a regular_expression for the `code_block_marker` is compiled
+# to find valid cases of `code_block_marker` in a given line and return
+# the groups: ``\1 prefix, \2 code_block_marker, \3 remainder`` ::
+
+        marker = code_block_marker
+        if marker == '::':
+            # the default marker may occur at the end of a text line
+            self.marker_regexp = re.compile('^( *(?!\.\.).*)(::)([ \n]*)$')
+        else:
+            # marker must be on a separate line
+            self.marker_regexp = re.compile('^( *)(%s)(.*\n?)$' % marker)
+
+# .. _get_dialect:
+#
+# get_dialect
+# -----------
+#
+# Return the Dialect_ for a converter class and settings. Empty settings are
+# completed from the class defaults (as in `TextCodeConverter.__init__`_).
+#
+# Dialects are cached by their settings and the currently registered filters
+# (so that changes of `defaults.preprocessors`_ and
+# `defaults.postprocessors`_ take effect). Converters can be instantiated
+# from a dialect, e.g. ``Text2Code(data, dialect=dialect)``. ::
+
+_dialects = {}
+
+def get_dialect(converter_class, language="", comment_string="",
+                code_block_marker=""):
+    """Return a (cached) `Dialect` instance for the settings"""
+    if not language:
+        language = converter_class.language
+    if language not in converter_class.comment_strings:
+        load_plugin(language)
+    if not comment_string:
+        comment_string = converter_class.comment_strings[language]
+    if not code_block_marker:
+        code_block_marker = converter_class.code_block_markers[language]
+    key = (converter_class, language, comment_string, code_block_marker,
+           _get_filter(converter_class, "preprocessors", language),
+           _get_filter(converter_class, "postprocessors", language))
+    try:
+        return _dialects[key]
+    except KeyError:
+        dialect = Dialect(converter_class, language, comment_string,
+                          code_block_marker)
+        _dialects[key] = dialect
+        return dialect
+
+# _get_filter
+# -----------
+#
+# Return the filter for `language` from `filter_set` (i.e.
+# `defaults.preprocessors`_ or `defaults.postprocessors`_), the key depends
+# on the conversion direction of `converter_class`. A list of filters is
+# combined with `compose_filters`_. The combined filters are cached by the
+# registered filters, so that repeated lookups (e.g. for the key of the
+# `get_dialect`_ cache) return the same filter without fusing it again::
+
+_filter_chains = {}
+
+def _get_filter(converter_class, filter_set, language):
+    """Return language specific filter"""
+    if converter_class == Text2Code:
+        key = "text2"+language
+    elif converter_class == Code2Text:
+        key = language+"2text"
+    else:
+        key = ""
+    try:
+        filter = getattr(defaults, filter_set)[key]
+    except (AttributeError, KeyError):
+        # print "there is no %r filter in %r"%(key, filter_set)
+        return identity_filter
+    if isinstance(filter, (list, tuple)):
+        filters = tuple(filter)
+        try:
+            return _filter_chains[filters]
+        except KeyError:
+            filter = _filter_chains[filters] = compose_filters(filters)
+    return filter
+
+
 # Filters
 # =======
 #
@@ -1058,7 +1579,116 @@ def identity_filter(data):
 def expandtabs_filter(data):
     """Yield data tokens with hard-tabs expanded"""
     for line in data:
-        yield line.expandtabs()
+        if "\t" in line:
+            line = line.expandtabs()
+        yield line
+
+# `str.expandtabs` always returns a new string. The test for a tab character
+# is much cheaper than the copy and saves it for the vast majority of lines.
+#
+# .. _line_filter:
+#
+# line_filter
+# -----------
+#
+# Most filters change single lines. `line_filter` turns a `function` mapping a
+# line to a line into a filter. The function is kept as attribute
+# `line_function`, so that a `FilterChain`_ can apply several of them in one
+# loop::
+
+def line_filter(function):
+    """Return a filter that applies `function` to every line"""
+    def filter(data):
+        for line in data:
+            yield function(line)
+    filter.line_function = function
+    filter.__name__ = function.__name__
+    filter.__module__ = function.__module__
+    filter.__doc__ = function.__doc__
+    return filter
+
+# .. _FilterChain:
+#
+# FilterChain
+# -----------
+#
+# Apply a sequence of `filters` in order. Every filter adds a generator to the
+# chain of iterators in `TextCodeConverter.__iter__`_, i.e. every line passes
+# one more generator frame. Adjacent line filters are fused into stages
+# calling up to three line functions in a single loop. (A loop over a list of
+# functions costs as much as the saved generator frames, the calls must be
+# written out.)
+#
+# Chains with the same filters compare equal, so that `get_dialect`_ can
+# cache dialects using them. The name of a chain lists its filters (it is
+# part of the key in the ConversionCache_)::
+
+class FilterChain(object):
+    """Apply filters in order, with adjacent line filters fused"""
+
+    def __init__(self, filters):
+        self.filters = tuple(filters)
+        self.__name__ = "FilterChain(%s)" % ", ".join(
+            ["%s.%s" % (filter.__module__, filter.__name__)
+             for filter in self.filters])
+        self.stages = []
+        fused = []
+        for filter in self.filters + (None,):
+            if getattr(filter, "line_function", None) is not None:
+                fused.append(filter)
+                continue
+            for i in range(0, len(fused), 3):
+                self.stages.append(self._fuse(fused[i:i+3]))
+            fused = []
+            if filter is not None:
+                self.stages.append(filter)
+
+    def _fuse(self, filters):
+        if len(filters) == 1:
+            return filters[0]
+        functions = [filter.line_function for filter in filters]
+        if len(functions) == 2:
+            (first, second) = functions
+            def fused_filter(data):
+                for line in data:
+                    yield second(first(line))
+        else:
+            (first, second, third) = functions
+            def fused_filter(data):
+                for line in data:
+                    yield third(second(first(line)))
+        return fused_filter
+
+    def __call__(self, data):
+        for stage in self.stages:
+            data = stage(data)
+        return data
+
+    def __eq__(self, other):
+        return (isinstance(other, FilterChain)
+                and self.filters == other.filters)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.filters)
+
+# .. _compose_filters:
+#
+# compose_filters
+# ---------------
+#
+# Return one filter for a list of `filters`. Empty lists and lists with only
+# one filter need no chain::
+
+def compose_filters(filters):
+    """Return a filter applying all `filters` in order"""
+    if not filters:
+        return identity_filter
+    if len(filters) == 1:
+        return filters[0]
+    return FilterChain(filters)
 
 
 # collect_blocks
@@ -1088,6 +1718,192 @@ def collect_blocks(lines):
         block.append(line)
     yield block
 
+# .. _tokenize_blocks:
+#
+# tokenize_blocks
+# ---------------
+#
+# `TextCodeConverter.convert`_ uses a combination of `expandtabs_filter`_ and
+# `collect_blocks`_ that works in one pass. Every line is stripped only once
+# to find blank lines and the indentation. The result is stored with the
+# block, so that `set_state` and the handlers do not need to strip the lines
+# again (see `TextCodeConverter.line_indents`_). ::
+
+def tokenize_blocks(lines):
+    """Expand tabs and collect lines in blocks separated by blank lines
+
+    Yield a `Block` (list of lines with attribute `indents`) for each
+    paragraph. Trailing blank lines are collected as well.
+    """
+    blank_line_reached = False
+    (buffer, ends, indents) = ("", array("l"), [])
+    add_end, add_indent = ends.append, indents.append
+    for line in lines:
+        if "\t" in line:
+            line = line.expandtabs()
+        stripped = line.lstrip()
+        if stripped:
+            if blank_line_reached:
+                yield _make_block(buffer, ends, indents)
+                blank_line_reached = False
+                (buffer, ends, indents) = ("", array("l"), [])
+                add_end, add_indent = ends.append, indents.append
+            add_indent(len(line) - len(stripped))
+        else:
+            blank_line_reached = True
+            add_indent(None)
+        buffer += line
+        add_end(len(buffer))
+    yield _make_block(buffer, ends, indents)
+
+# .. _Block:
+#
+# Block
+# ~~~~~
+#
+# A `Block` is a sequence of lines with an additional list `indents` holding
+# the indentation of every line or ``None`` for blank lines.
+#
+# The lines are stored as one string `buffer` and an array with the `ends`
+# of the lines in the buffer. Compared to a list of strings, this saves the
+# overhead of one string object per line, which dominates the memory use for
+# large blocks. The lines are created when they are first accessed (by
+# iteration or index) and kept in `_lines` while the block is converted
+# (`set_state` and the handlers iterate a block several times). So custom
+# handlers can use a block like a list of lines. The list methods modifying a
+# block rebuild buffer, ends and indents (they are rarely used and need not
+# be fast), concatenation returns a list.
+#
+# ::
+
+class Block(object):
+    """Sequence of lines stored in one string, with precomputed indents"""
+    __slots__ = ("buffer", "ends", "indents", "_lines")
+
+    def __init__(self, lines=()):
+        lines = list(lines)
+        self.buffer = "".join(lines)
+        self.ends = array("l")
+        end = 0
+        for line in lines:
+            end += len(line)
+            self.ends.append(end)
+        self.indents = [_line_indent(line) for line in lines]
+        self._lines = None
+
+    def lines(self):
+        """Return the list of lines (created once)"""
+        if self._lines is None:
+            (buffer, start, lines) = (self.buffer, 0, [])
+            add_line = lines.append
+            for end in self.ends:
+                add_line(buffer[start:end])
+                start = end
+            self._lines = lines
+        return self._lines
+
+# Drop the list of lines after the conversion of the block::
+
+    def release(self):
+        self._lines = None
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __getitem__(self, index):
+        return self.lines()[index]
+
+    def __contains__(self, line):
+        return line in list(self)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def index(self, line, *args):
+        return list(self).index(line, *args)
+
+    def count(self, line):
+        return list(self).count(line)
+
+# Modifications::
+
+    def __setitem__(self, index, value):
+        lines = list(self)
+        lines[index] = value
+        self.__init__(lines)
+
+    def __delitem__(self, index):
+        lines = list(self)
+        del lines[index]
+        self.__init__(lines)
+
+    def append(self, line):
+        self.extend([line])
+
+    def extend(self, lines):
+        self.__init__(list(self) + list(lines))
+
+    def insert(self, index, line):
+        lines = list(self)
+        lines.insert(index, line)
+        self.__init__(lines)
+
+    def pop(self, index=-1):
+        lines = list(self)
+        line = lines.pop(index)
+        self.__init__(lines)
+        return line
+
+    def remove(self, line):
+        lines = list(self)
+        lines.remove(line)
+        self.__init__(lines)
+
+    def __eq__(self, other):
+        try:
+            return self.lines() == list(other)
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Block(%r)" % list(self)
+
+# `tokenize_blocks`_ appends the lines to the buffer (without keeping them)
+# and collects their ends and indents in one pass, the block is created
+# without a second iteration::
+
+def _make_block(buffer, ends, indents):
+    block = Block.__new__(Block)
+    block.buffer = buffer
+    block.ends = ends
+    block.indents = indents
+    block._lines = None
+    return block
+
+# _line_indent
+# ~~~~~~~~~~~~
+# ::
+
+def _line_indent(line):
+    """Return indentation of `line` or None if it is blank"""
+    stripped = line.lstrip()
+    if stripped:
+        return len(line) - len(stripped)
+    return None
+
 
 
 # dumb_c_preprocessor
@@ -1154,15 +1970,335 @@ def dumb_c_postprocessor(data):
         yield line
 
 
+# C comment filters
+# -----------------
+#
+# The dumb_c filters only see single lines. The C comment filters use a small
+# lexer that keeps track of block comments, line comments and string
+# literals across lines, so that comment delimiters in strings or inside
+# other comments are left alone. Every line is scanned once.
+#
+# _scan_c_line
+# ~~~~~~~~~~~~
+#
+# Return the lexer state at the end of `line`, starting in `state` at `pos`.
+# The state is ``None`` in code, ``"/*"`` in a block comment, ``"//"`` in a
+# line comment continued with a backslash and the quote character in a
+# string or character literal continued with a backslash::
+
+_c_token_regexp = None
+_c_literal_regexps = {}
+
+# The regular expressions are compiled when the C filters are used for the
+# first time (not on start-up)::
+
+def _compile_c_regexps():
+    global _c_token_regexp
+    if _c_token_regexp is None:
+        _c_token_regexp = re.compile(r'/\*|//|"|\'')
+        _c_literal_regexps['"'] = re.compile(r'(?:[^"\\\n]|\\.)*"')
+        _c_literal_regexps["'"] = re.compile(r"(?:[^'\\\n]|\\.)*'")
+
+# ::
+
+def _scan_c_line(line, state=None, pos=0):
+    """Return the C lexer state at the end of `line`"""
+    while True:
+        if state is None:
+            match = _c_token_regexp.search(line, pos)
+            if match is None:
+                return None
+            (state, pos) = (match.group(), match.end())
+        elif state == "/*":
+            end = line.find("*/", pos)
+            if end < 0:
+                return state
+            (state, pos) = (None, end + 2)
+        elif state == "//":
+            if line.rstrip("\r\n").endswith("\\"):
+                return state
+            return None
+        else:
+            match = _c_literal_regexps[state].match(line, pos)
+            if match is None:
+                if line.rstrip("\r\n").endswith("\\"):
+                    return state
+                return None # unterminated literal
+            (state, pos) = (None, match.end())
+
+# c_comment_preprocessor
+# ~~~~~~~~~~~~~~~~~~~~~~
+#
+# Convert `C` block comments into C++ ``//`` comment lines. Only comments that
+# start a line with "/\*" followed by whitespace and end a line (with "\*/"
+# followed by whitespace only) are converted, other comments belong to the
+# code. A comment may span several lines::
+
+def c_comment_preprocessor(data):
+    """change `C` ``/* `` `` */`` comments into C++ ``// `` comments"""
+    comment_string = defaults.comment_strings["c++"]
+    _compile_c_regexps()
+    state = None
+    comment = []
+    for line in data:
+        if comment:
+            start = 0
+        elif state is None and line[:2] == "/*" and line[2:3].isspace():
+            start = 2
+        else:
+            state = _scan_c_line(line, state)
+            yield line
+            continue
+        comment.append(line)
+        end = line.find("*/", start)
+        if end < 0:
+            continue
+        if line[end+2:].strip():
+            lines = comment # code follows the comment
+            state = _scan_c_line(line, None, end+2)
+        else:
+            lines = _uncomment_c(comment, comment_string)
+        for line in lines:
+            yield line
+        comment = []
+    for line in comment: # unterminated comment
+        yield line
+
+# Strip the comment delimiters and the continuation prefix (up to 3 spaces or
+# a leading " \* ") from the lines of a comment. Empty first and last lines
+# are dropped::
+
+def _uncomment_c(comment, comment_string):
+    """Return list of ``// `` lines with the content of a `C` comment"""
+    last = len(comment) - 1
+    lines = []
+    for (i, line) in enumerate(comment):
+        if i == last:
+            line = line[:line.rfind("*/")]
+        if i == 0:
+            line = line[2:]
+            if line[:1] == " ":
+                line = line[1:]
+        elif line[:2] == " *" and line[2:3] in ("", " ", "\n", "\r"):
+            line = line[3:]
+        else:
+            line = line[min(3, len(line) - len(line.lstrip(" "))):]
+        line = line.rstrip()
+        if line:
+            lines.append(comment_string + line + "\n")
+        elif 0 < i < last:
+            lines.append(comment_string.rstrip() + "\n")
+    return lines or [comment_string.rstrip() + "\n"]
+
+# c_comment_postprocessor
+# ~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Convert runs of C++ ``//`` comment lines in code into one `C` block comment.
+# Continuation lines are indented by 3 spaces, so that
+# `c_comment_preprocessor`_ restores the original comment lines::
+
+def c_comment_postprocessor(data):
+    """change C++ ``// `` comments into `C` ``/* `` `` */`` comments"""
+    comment_string = defaults.comment_strings["c++"]
+    _compile_c_regexps()
+    state = None
+    comment = []
+    for line in data:
+        if state is None and (line.startswith(comment_string) or
+                              line.rstrip() == comment_string.rstrip()):
+            comment.append(line)
+            continue
+        if comment:
+            for comment_line in _comment_c(comment, comment_string):
+                yield comment_line
+            comment = []
+        state = _scan_c_line(line, state)
+        yield line
+    for line in _comment_c(comment, comment_string):
+        yield line
+
+# Runs without content are kept, as are runs containing a "\*/" (which
+# would end the block comment prematurely)::
+
+def _comment_c(comment, comment_string):
+    """Return list of lines of a `C` comment with the ``//`` lines content"""
+    contents = [line[len(comment_string):].rstrip() for line in comment]
+    if (not "".join(contents)
+        or [content for content in contents if "*/" in content]):
+        return comment
+    lines = ["/* " + contents[0]]
+    lines += [("   " + content).rstrip() for content in contents[1:]]
+    lines[0] = lines[0].rstrip()
+    lines[-1] += " */"
+    return [line + "\n" for line in lines]
+
+
+# .. _register_language:
+#
+# register_language
+# -----------------
+#
+# Declare the settings for a `language` in one place: file `extensions`,
+# `comment_string`, `code_block_marker` and lists of `preprocessors` and
+# `postprocessors`. The filters are appended to the ones already registered
+# for the language (a single registered filter is turned into a list), so
+# that several extensions can add filters for the same language::
+
+def register_language(language, extensions=(), comment_string=None,
+                      code_block_marker=None, preprocessors=(),
+                      postprocessors=()):
+    """Register settings and filters for `language` in `defaults`"""
+    for extension in extensions:
+        defaults.languages[extension] = language
+    if comment_string is not None:
+        defaults.comment_strings[language] = comment_string
+    if code_block_marker is not None:
+        defaults.code_block_markers[language] = code_block_marker
+    for (filter_set, key, filters) in (
+            (defaults.preprocessors, language+"2text", preprocessors),
+            (defaults.postprocessors, "text2"+language, postprocessors)):
+        if not filters:
+            continue
+        registered = filter_set.get(key, [])
+        if not isinstance(registered, list):
+            registered = [registered]
+        filter_set[key] = registered + list(filters)
+
 # register filters
 # ----------------
 #
 # ::
 
-defaults.preprocessors['c2text'] = dumb_c_preprocessor
-defaults.preprocessors['css2text'] = dumb_c_preprocessor
-defaults.postprocessors['text2c'] = dumb_c_postprocessor
-defaults.postprocessors['text2css'] = dumb_c_postprocessor
+register_language("c", preprocessors=[c_comment_preprocessor],
+                  postprocessors=[c_comment_postprocessor])
+register_language("css", preprocessors=[c_comment_preprocessor],
+                  postprocessors=[c_comment_postprocessor])
+
+
+# .. _plug-ins:
+#
+# Plug-ins
+# ========
+#
+# Support for more languages is provided by plug-ins, modules that call
+# `register_language`_ when imported. Importing every plug-in on start-up
+# would slow down every run, so plug-ins are registered in
+# `defaults.plugins`_ by language and extension and only imported on demand.
+#
+# .. _load_plugin:
+#
+# load_plugin
+# -----------
+#
+# Import the plug-in for the language or extension `name` (once). Return
+# whether a plug-in is loaded. If `name` is not registered or its plug-in
+# cannot be imported, the plug-ins are searched (once) with
+# `discover_plugins`_::
+
+_plugins_discovered = False
+_plugin_modules = {}
+
+def load_plugin(name):
+    """Import the plug-in for language or extension `name`"""
+    global _plugins_discovered
+    if _load_plugin(name):
+        return True
+    if _plugins_discovered:
+        return False
+    _plugins_discovered = True
+    discover_plugins()
+    return _load_plugin(name)
+
+def _load_plugin(name):
+    plugin = defaults.plugins.get(name)
+    if plugin is None:
+        return False
+    if plugin not in _plugin_modules:
+        _plugin_modules[plugin] = _import_plugin(plugin)
+    return _plugin_modules[plugin] is not None
+
+# Plug-ins ``import pylit``. If this module runs as a script, it is
+# registered as `pylit`, so that they register with it and not with a second
+# copy::
+
+def _import_plugin(plugin):
+    """Import and return plug-in module (None if not found)"""
+    sys.modules.setdefault("pylit", sys.modules[__name__])
+    try:
+        if plugin.endswith(".py"):
+            import imp
+            name = os.path.splitext(os.path.basename(plugin))[0]
+            return imp.load_source(name, plugin)
+        return __import__(plugin)
+    except ImportError:
+        return None
+
+# .. _discover_plugins:
+#
+# discover_plugins
+# ----------------
+#
+# Add plug-ins to `defaults.plugins`_ (without importing them):
+#
+# * files ``pylit_<language>.py`` in the directories of
+#   `defaults.plugin_path` (set from the environment variable
+#   ``PYLIT_PLUGIN_PATH``). The extensions of the language can be declared
+#   in a comment in the first 3 lines, e.g. ``# pylit-extensions: .el``,
+#
+# * setuptools entry points in the group ``pylit.languages``, named by
+#   language or extension, e.g. in ``setup.py``::
+#
+#     entry_points={"pylit.languages": ["elisp = pylit_elisp",
+#                                       ".el = pylit_elisp"]}
+#
+# Registered plug-ins take precedence, unless they cannot be imported::
+
+def discover_plugins():
+    """Register plug-ins from `defaults.plugin_path` and entry points"""
+    file_regexp = re.compile(r"pylit_(\w+)\.py$")
+    extensions_regexp = re.compile(r"#.*pylit-extensions:(.*)")
+    for directory in defaults.plugin_path:
+        try:
+            filenames = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for filename in filenames:
+            match = file_regexp.match(filename)
+            if not match:
+                continue
+            path = os.path.join(directory, filename)
+            _add_plugin(match.group(1), path)
+            stream = file(path)
+            for (i, line) in izip(range(3), stream):
+                match = extensions_regexp.match(line)
+                if match:
+                    for extension in match.group(1).split():
+                        _add_plugin(extension, path)
+            stream.close()
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+    for entry_point in pkg_resources.iter_entry_points("pylit.languages"):
+        _add_plugin(entry_point.name, entry_point.module_name)
+
+def _add_plugin(name, plugin):
+    registered = defaults.plugins.get(name)
+    if registered is None or (registered in _plugin_modules
+                              and _plugin_modules[registered] is None):
+        defaults.plugins[name] = plugin
+
+# _known_extension
+# ----------------
+#
+# Return whether `extension` is in `languages`, loading a plug-in for it if
+# required::
+
+def _known_extension(extension, languages):
+    if extension in languages:
+        return True
+    return (bool(extension) and load_plugin(extension)
+            and extension in languages)
 
 
 # Command line use
@@ -1218,7 +2354,7 @@ defaults.postprocessors['text2css'] = dumb_c_postprocessor
 # The following class adds `as_dict`_, `complete`_ and `__getattr__`_
 # methods to `optparse.Values`::
 
-class OptionValues(optparse.Values):
+class OptionValues(Values):
 
 # .. _OptionValues.as_dict:
 #
@@ -1246,9 +2382,10 @@ class OptionValues(optparse.Values):
         Do not overwrite existing values. Only use arguments that do not
         have a corresponding attribute in `self`,
         """
+        values = self.__dict__
         for key in keyw:
-            if not self.__dict__.has_key(key):
-                setattr(self, key, keyw[key])
+            if key not in values:
+                values[key] = keyw[key]
 
 # .. _OptionValues.__getattr__:
 #
@@ -1284,9 +2421,29 @@ class PylitOptions(object):
 # ::
 
     def __init__(self):
+        self._parser = None
+
+# .. _PylitOptions.parser:
+#
+# parser
+# ~~~~~~
+#
+# The `optparse.OptionParser` instance for pylit command line options is set
+# up when it is needed for the first time (a plain conversion does not need
+# it)::
+
+    def _get_parser(self):
+        if self._parser is None:
+            self._parser = self._make_parser()
+        return self._parser
+
+    parser = property(_get_parser)
+
+    def _make_parser(self):
         """Set up an `OptionParser` instance for pylit command line options
 
         """
+        import optparse
         p = optparse.OptionParser(usage=main.__doc__, version=_version)
 
         # Conversion settings
@@ -1296,7 +2453,6 @@ class PylitOptions(object):
         p.add_option("-t", "--txt2code", action="store_true",
                      help="convert text source to code source")
         p.add_option("--language",
-                     choices = defaults.languages.values(),
                      help="use LANGUAGE native comment style")
         p.add_option("--comment-string", dest="comment_string",
                      help="documentation block marker in code source "
@@ -1315,19 +2471,68 @@ class PylitOptions(object):
                      help="overwrite output file (default 'update')")
         p.add_option("--replace", action="store_true",
                      help="move infile to a backup copy (appending '~')")
+        p.add_option("--no-atomic", dest="atomic", action="store_false",
+                     help="write the output file directly (not via a "
+                     "temporary file replacing it when complete)")
+        p.add_option("--buffer-size", type="int", metavar="BYTES",
+                     help="buffer size for writing the output file "
+                     "(default %d)" % defaults.buffer_size)
+        p.add_option("--fsync", action="store_true",
+                     help="flush the output file to disk before it "
+                     "replaces OUTFILE")
+        p.add_option("--cache-dir", dest="cache_dir",
+                     help="skip conversion (and doctests) of unchanged "
+                     "files using a content-hash cache in CACHE_DIR "
+                     "(doctests are repeated if an imported module changed, "
+                     "except for the standard library and installed "
+                     "packages)")
+        p.add_option("--mmap", dest="use_mmap", action="store_true",
+                     help="read the input file via memory mapping")
+        p.add_option("--source-map", dest="write_source_map",
+                     action="store_true",
+                     help="write a line number map to OUTFILE.map")
         p.add_option("-s", "--strip", action="store_true",
                      help='"export" by stripping documentation or code')
+        p.add_option("-r", "--recursive", action="store_true",
+                     help="convert all sources in the INFILE arguments "
+                     "(files or directories)")
+        p.add_option("-j", "--jobs", type="int",
+                     help="number of parallel processes for --recursive "
+                     "and --doctest (0: one per CPU, default 1)")
+        p.add_option("-w", "--watch", action="store_true",
+                     help="watch the INFILE arguments (files or directories) "
+                     "and convert changed files (until interrupted)")
 
         # Special actions
 
+        p.add_option("--profile", action="store_true",
+                     help="report time spent in the conversion stages")
         p.add_option("-d", "--diff", action="store_true",
                      help="test for differences to existing file")
+        p.add_option("--check", action="store_true",
+                     help="test if the output files are up to date (exit "
+                     "status 1 if not)")
+        p.add_option("--verify", action="store_true",
+                     help="test if converting forth and back reproduces "
+                     "the input (exit status 1 if not)")
         p.add_option("--doctest", action="store_true",
                      help="run doctest.testfile() on the text version")
+        p.add_option("--serve", action="store_true",
+                     help="run a JSON-RPC conversion server on stdin/stdout "
+                     "(or --socket)")
+        p.add_option("--socket", metavar="PATH",
+                     help="listen on the Unix domain socket PATH with "
+                     "--serve")
+        p.add_option("--timeout", type="float",
+                     help="time limit in seconds for the doctests of "
+                     "one file")
+        p.add_option("--junit-xml", dest="junit_xml", metavar="FILE",
+                     help="write a JUnit XML report of the doctests to FILE")
         p.add_option("-e", "--execute", action="store_true",
-                     help="execute code (Python only)")
+                     help="execute code (Python only), with --cache-dir "
+                     "the compiled code is cached in CACHE_DIR")
 
-        self.parser = p
+        return p
 
 # .. _PylitOptions.parse_args:
 #
@@ -1336,7 +2541,8 @@ class PylitOptions(object):
 #
 # The `parse_args` method calls the `optparse.OptionParser` on command
 # line or provided args and returns the result as `PylitOptions.Values`
-# instance. Defaults can be provided as keyword arguments::
+# instance. Defaults can be provided as keyword arguments. Arguments without
+# options are handled without the option parser::
 
     def parse_args(self, args=sys.argv[1:], **keyw):
         """parse command line arguments using `optparse.OptionParser`
@@ -1346,8 +2552,32 @@ class PylitOptions(object):
             args --  list of command line arguments.
             keyw --  keyword arguments or dictionary of option defaults
         """
-        # parse arguments
-        (values, args) = self.parser.parse_args(args, OptionValues(keyw))
+        # parse arguments (a plain conversion with at most INFILE and
+        # OUTFILE needs no option parser)
+        if len(args) <= 2 and not [arg for arg in args
+                                   if arg.startswith("-") and arg != "-"]:
+            values = OptionValues(keyw)
+        else:
+            (values, args) = self.parser.parse_args(args, OptionValues(keyw))
+        # languages of plug-ins are only known after loading the plug-in
+        languages = values.languages or defaults.languages
+        if (values.language
+            and values.language not in languages.values()
+            and not load_plugin(values.language)):
+            self.parser.error("option --language: invalid choice: %r"
+                              % values.language)
+        if values.jobs is not None and values.jobs < 0:
+            self.parser.error("option --jobs: must not be negative: %d"
+                              % values.jobs)
+        # With --recursive or --watch, all positional args are input files
+        # or dirs
+        if values.recursive or values.watch:
+            values.infiles = args
+            return values
+        # --doctest, --check, and --verify accept any number of input files
+        # or dirs
+        if values.doctest or values.check or values.verify:
+            values.infiles = args
         # Convert FILE and OUTFILE positional args to option values
         # (other positional arguments are ignored)
         try:
@@ -1388,7 +2618,7 @@ class PylitOptions(object):
             in_extension = os.path.splitext(values.infile)[1]
             if in_extension in values.text_extensions:
                 values.txt2code = True
-            elif in_extension in values.languages.keys():
+            elif _known_extension(in_extension, values.languages):
                 values.txt2code = False
 
 # Auto-determine the output file name::
@@ -1407,6 +2637,7 @@ class PylitOptions(object):
             code_extension = os.path.splitext(values.outfile)[1]
         elif values.txt2code is False:
             code_extension = os.path.splitext(values.infile)[1]
+        _known_extension(code_extension, values.languages)
         values.ensure_value("language", values.languages[code_extension])
 
         return values
@@ -1437,7 +2668,8 @@ class PylitOptions(object):
         (base, ext) = os.path.splitext(values.infile)
         if ext in values.text_extensions:
             return base # strip
-        if ext in values.languages.keys() or values.txt2code == False:
+        if (_known_extension(ext, values.languages)
+            or values.txt2code == False):
             return values.infile + values.text_extensions[0] # add
         # give up
         return values.infile + ".out"
@@ -1471,24 +2703,33 @@ class PylitOptions(object):
 # However,  this leaves the uninitiated user with a non-responding application
 # if (s)he just tries the script without any arguments) ::
 
-def open_streams(infile = '-', outfile = '-', overwrite='update', **keyw):
+def open_streams(infile = '-', outfile = '-', overwrite='update',
+                 use_mmap=False, atomic=False, buffer_size=-1, fsync=False,
+                 **keyw):
     """Open and return the input and output stream
 
     open_streams(infile, outfile) -> (in_stream, out_stream)
 
     in_stream   --  file(infile) or sys.stdin
+                    (MappedFile(infile) if `use_mmap` is True)
     out_stream  --  file(outfile) or sys.stdout
+                    (AtomicFile(outfile) if `atomic` is True)
     overwrite   --  'yes': overwrite eventually existing `outfile`,
                     'update': fail if the `outfile` is newer than `infile`,
                     'no': fail if `outfile` exists.
 
                     Irrelevant if `outfile` == '-'.
+    buffer_size --  buffer size of the output file (-1: system default)
+    fsync       --  flush an atomic output file to disk before it
+                    replaces `outfile`
     """
     if not infile:
         strerror = "Missing input file name ('-' for stdin; -h for help)"
         raise IOError, (2, strerror, infile)
     if infile == '-':
         in_stream = sys.stdin
+    elif use_mmap:
+        in_stream = MappedFile(infile)
     else:
         in_stream = file(infile, 'r')
     if outfile == '-':
@@ -1497,17 +2738,165 @@ def open_streams(infile = '-', outfile = '-', overwrite='update', **keyw):
         raise IOError, (1, "Output file exists!", outfile)
     elif overwrite == 'update' and is_newer(outfile, infile):
         raise IOError, (1, "Output file is newer than input file!", outfile)
+    elif atomic:
+        out_stream = AtomicFile(outfile, buffer_size, fsync)
     else:
-        out_stream = file(outfile, 'w')
+        out_stream = file(outfile, 'w', buffer_size)
     return (in_stream, out_stream)
 
-# is_newer
-# ~~~~~~~~
+# .. _AtomicFile:
 #
-# ::
+# AtomicFile
+# ~~~~~~~~~~
+#
+# An output file that is written to a temporary file in the directory of the
+# target file `name`. Closing the file renames it to `name`, i.e. the target
+# is replaced in one step and never holds partial output. `discard` removes
+# the temporary file and keeps the target unchanged (e.g. after a conversion
+# error).
+#
+# The temporary file gets the permissions of an existing target (or the
+# default permissions for new files). A symbolic link is kept, its target is
+# replaced. ::
+
+_tmpfile_numbers = count()
+
+class AtomicFile(object):
+    """Output file replacing the file `name` when closed"""
+
+    def __init__(self, name, buffer_size=-1, fsync=False):
+        import errno
+        self.name = name
+        self.fsync = fsync
+        self.closed = False
+        self._target = os.path.realpath(name)
+        (directory, basename) = os.path.split(self._target)
+        while True:
+            self._tmpname = os.path.join(directory, ".%s.%d.%d.tmp" %
+                                         (basename, os.getpid(),
+                                          _tmpfile_numbers.next()))
+            try:
+                fd = os.open(self._tmpname,
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+                break
+            except OSError, error:
+                if error.errno != errno.EEXIST:
+                    raise
+        try:
+            os.chmod(self._tmpname, os.stat(self._target).st_mode & 07777)
+        except OSError: # new file
+            pass
+        self._file = os.fdopen(fd, 'w', buffer_size)
+        self.write = self._file.write
+        self.writelines = self._file.writelines
 
-def is_newer(path1, path2):
-    """Check if `path1` is newer than `path2` (using mtime)
+    def flush(self):
+        self._file.flush()
+
+# Close the temporary file and replace the target. Under Windows, `os.rename`
+# does not replace existing files, the target is removed first::
+
+    def close(self):
+        """Close the file and replace the target file with it"""
+        if self.closed:
+            return
+        try:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            try:
+                os.rename(self._tmpname, self._target)
+            except OSError:
+                if not os.path.exists(self._target):
+                    raise
+                os.remove(self._target)
+                os.rename(self._tmpname, self._target)
+        except:
+            self.discard()
+            raise
+        self.closed = True
+        if self.fsync:
+            _fsync_directory(os.path.dirname(self._target))
+
+    def discard(self):
+        """Close and remove the temporary file, keep the target file"""
+        if self.closed:
+            return
+        self.closed = True
+        self._file.close()
+        try:
+            os.remove(self._tmpname)
+        except OSError:
+            pass
+
+# The renaming is only durable when the directory entry is on disk, too.
+# (Directories cannot be opened under Windows)::
+
+def _fsync_directory(path):
+    try:
+        fd = os.open(path or os.curdir, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+    finally:
+        os.close(fd)
+
+# .. _MappedFile:
+#
+# MappedFile
+# ~~~~~~~~~~
+#
+# A read-only input file backed by a memory map (`mmap` module). Iterating
+# yields the lines of the file, split lazily from the mapped buffer, without
+# the read-ahead buffer copies of file iteration. This pays off for very large
+# input files. Empty files cannot be mapped and yield no lines. ::
+
+class MappedFile(object):
+    """Memory mapped input file with a file-like interface"""
+
+    def __init__(self, name):
+        import mmap
+        self.name = name
+        self._file = file(name, 'rb')
+        if os.path.getsize(name):
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            self._map = ""
+
+    def __iter__(self):
+        buf = self._map
+        find = buf.find
+        start = 0
+        end = find("\n", start)
+        while end >= 0:
+            yield buf[start:end+1]
+            start = end + 1
+            end = find("\n", start)
+        if start < len(buf):
+            yield buf[start:]
+
+    def read(self):
+        return self._map[:]
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+# is_newer
+# ~~~~~~~~
+#
+# ::
+
+def is_newer(path1, path2):
+    """Check if `path1` is newer than `path2` (using mtime)
 
     Compare modification time of files at path1 and path2.
 
@@ -1532,6 +2921,168 @@ def is_newer(path1, path2):
         return None
     return mtime1 > mtime2
 
+# .. _find_sources:
+#
+# find_sources
+# ~~~~~~~~~~~~
+#
+# Expand a list of file and directory names into a list of input files for
+# the batch conversion with ``--recursive``. Files are taken as given,
+# directories are walked and searched for sources in the conversion direction:
+#
+# * text sources (txt2code): files with a `text_extension`_ preceded by a
+#   known code extension, e.g. ``foo.py.txt`` (but not ``README.txt``),
+# * code sources (code2txt): files with a known code extension.
+#
+# If the direction is not given (``None``), text sources are searched. ::
+
+def find_sources(paths, txt2code=None, text_extensions=None, languages=None):
+    """Return sorted list of files in `paths` (walking directories)
+    """
+    if text_extensions is None:
+        text_extensions = defaults.text_extensions
+    if languages is None:
+        languages = defaults.languages
+    sources = []
+    for path in paths:
+        if not os.path.isdir(path):
+            sources.append(path)
+            continue
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                (base, ext) = os.path.splitext(filename)
+                if txt2code is False:
+                    is_source = _known_extension(ext, languages)
+                else:
+                    is_source = (ext in text_extensions and
+                                 _known_extension(os.path.splitext(base)[1],
+                                                  languages))
+                if is_source:
+                    sources.append(os.path.join(dirpath, filename))
+    return sources
+
+
+# _hexdigest
+# ~~~~~~~~~~
+#
+# Return the SHA1 hash of a sequence of strings as hexadecimal string::
+
+def _hexdigest(*strings):
+    """Return hex digest of the concatenation of `strings`"""
+    try:
+        from hashlib import sha1
+    except ImportError: # Python < 2.5
+        from sha import new as sha1
+    digest = sha1()
+    for string in strings:
+        digest.update(string)
+    return digest.hexdigest()
+
+# Iterate over the content of the file at `path` in chunks of `size` bytes::
+
+def _iter_chunks(path, size=2**16):
+    """Yield content of file at `path` in chunks"""
+    stream = file(path, 'rb')
+    try:
+        chunk = stream.read(size)
+        while chunk:
+            yield chunk
+            chunk = stream.read(size)
+    finally:
+        stream.close()
+
+# Compare the content of two files chunk by chunk::
+
+def _same_content(path1, path2):
+    """Return True if the files at `path1` and `path2` have equal content"""
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    for (chunk1, chunk2) in izip(_iter_chunks(path1), _iter_chunks(path2)):
+        if chunk1 != chunk2:
+            return False
+    return True
+
+# Return a hash of the input data (given as iterable of strings `chunks`) and
+# the settings of `converter`, i.e. everything that influences the output:
+# direction, language, comment and marker strings, indentation, the strip
+# options, the registered filters and the PyLit version::
+
+def _conversion_key(chunks, converter):
+    """Return hex digest of input data and converter settings"""
+    settings = [_version, converter.__class__.__name__]
+    for name in ("language", "comment_string", "code_block_marker",
+                 "header_string", "codeindent", "strip", "strip_marker",
+                 "add_missing_marker"):
+        settings.append(getattr(converter, name))
+    for filter in (converter.preprocessor, converter.postprocessor):
+        settings.append("%s.%s" % (filter.__module__, filter.__name__))
+    return _hexdigest(repr(settings), *chunks)
+
+# .. _ConversionCache:
+#
+# ConversionCache
+# ~~~~~~~~~~~~~~~
+#
+# An on-disk store of conversion results. The key of an entry is a hash of the
+# input data and the effective converter settings, i.e. the same input
+# converted with the same settings gives the same output. The modification
+# time of the files is not used. ::
+
+class ConversionCache(object):
+    """Store converted data keyed by a hash of input and settings"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+# The `key` covers everything that influences the output of `converter` (see
+# `_conversion_key`)::
+
+    def key(self, chunks, converter):
+        """Return cache key for the conversion of the input data (given
+        as iterable of strings `chunks`) with `converter`"""
+        return _conversion_key(chunks, converter)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+# Return the cached output for `key` or None::
+
+    def get(self, key):
+        try:
+            stream = file(self.path(key), 'rb')
+        except IOError:
+            return None
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+
+# Store the `output` (a string or an iterable of lines) for `key`. Write to
+# a temporary file first, so that concurrent processes never see a partial
+# cache entry::
+
+    def put(self, key, output):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmppath = "%s.%d.tmp" % (self.path(key), os.getpid())
+        stream = file(tmppath, 'wb')
+        try:
+            try:
+                if isinstance(output, basestring):
+                    stream.write(output)
+                else:
+                    stream.writelines(output)
+            finally:
+                stream.close()
+        except: # e.g. conversion error, don't leave the temporary file
+            os.remove(tmppath)
+            raise
+        try:
+            os.rename(tmppath, self.path(key))
+        except OSError: # existing entry (Windows)
+            os.remove(tmppath)
+
 
 # get_converter
 # ~~~~~~~~~~~~~
@@ -1544,16 +3095,617 @@ def get_converter(data, txt2code=True, **keyw):
     else:
         return Code2Text(data, **keyw)
 
+# .. _convert_stream:
+#
+# convert_stream
+# ~~~~~~~~~~~~~~
+#
+# Convert the data from `in_stream` and write it to `out_stream`.
+#
+# The converted lines are passed to the `writelines` method of the output
+# stream as they are produced by the converter's iterator. A file object
+# buffers the writes internally, so the peak memory use is bounded by the
+# largest block of the input instead of the size of the document. ::
+
+def convert_stream(in_stream, out_stream, txt2code=True, profiler=None,
+                   **keyw):
+    """Convert data from `in_stream` and write it to `out_stream`
+    """
+    converter = get_converter(in_stream, txt2code, profiler=profiler, **keyw)
+    if profiler is None:
+        out_stream.writelines(converter)
+    else:
+        profiler.call("write", out_stream.writelines, converter)
+
+
+# .. _IncrementalConverter:
+#
+# IncrementalConverter
+# ~~~~~~~~~~~~~~~~~~~~
+#
+# Keep the conversion of a document up to date while it is edited (e.g. for
+# a live preview in an editor). After an edit, only the blocks from the first
+# affected block are converted again, until the converter state
+# re-synchronises with the previous conversion. The output of the following
+# blocks is reused.
+#
+# The blocks are separated by blank lines (see `tokenize_blocks`_), hence the
+# block boundaries after an edit are only changed in the blocks containing
+# the edited lines and the preceding block (e.g. if blank lines are inserted
+# or removed at the end of a block). The conversion of a block depends on the
+# state of the converter at the start of the block. The state is described by
+# the attributes `_state_attributes`. A snapshot of them is stored after every
+# block. The re-conversion stops at the first block that ends at an old
+# block boundary after the edit with the same state as before.
+#
+# Language specific filters (see `Filters`_) may process the document as a
+# whole. If the converter uses a pre- or postprocessor, every edit results in
+# a complete conversion. ::
+
+class IncrementalConverter(object):
+    """Convert a document and update the conversion after edits
+    """
+    _state_attributes = ("state", "_codeindent", "_textindent",
+                         "_add_code_block_marker")
+
+    def __init__(self, data, txt2code=True, **keyw):
+        self.converter = get_converter([], txt2code, **keyw)
+        self.incremental = (self.converter.preprocessor is identity_filter
+                            and self.converter.postprocessor
+                                is identity_filter)
+        self.lines = list(data)
+        self.blocks = []    # input lines of the blocks
+        self.starts = []    # index of the first line of every block
+        self.outputs = []   # converted lines of the blocks
+        self.snapshots = [] # converter state after every block
+        self.reconverted = 0
+        self._convert_all()
+
+# The converted document::
+
+    def __iter__(self):
+        for output in self.outputs:
+            for line in output:
+                yield line
+
+    def __call__(self):
+        """Return list of converted lines"""
+        return list(self)
+
+# Converter state snapshots. The initial state is the one set in
+# `TextCodeConverter.convert`_::
+
+    def _snapshot(self):
+        converter = self.converter
+        return tuple([getattr(converter, name)
+                      for name in self._state_attributes])
+
+    def _restore(self, snapshot):
+        for (name, value) in zip(self._state_attributes, snapshot):
+            setattr(self.converter, name, value)
+
+    _initial_snapshot = ("", 0, 0, False)
+
+# Convert the blocks of the lines starting at `start` with the converter in
+# the state `snapshot`. Yield ``(block, output, snapshot)`` for every block::
+
+    def _convert_blocks(self, start, snapshot):
+        converter = self.converter
+        self._restore(snapshot)
+        lines = self.lines
+        for block in tokenize_blocks(lines[i]
+                                     for i in xrange(start, len(lines))):
+            if not block:
+                break
+            converter.set_state(block)
+            output = list(getattr(converter, converter.state+"_handler")(block))
+            yield (block, output, self._snapshot())
+
+# Convert the complete document. Without incremental update, this is done by
+# the converter (with pre- and postprocessing)::
+
+    def _convert_all(self):
+        if not self.incremental:
+            self.converter.data = self.lines
+            self.starts = [0]
+            self.blocks = [self.lines]
+            self.outputs = [self.converter()]
+            self.snapshots = [None]
+            return
+        self.starts, self.blocks, self.outputs, self.snapshots = [], [], [], []
+        start = 0
+        for (block, output, snapshot) in self._convert_blocks(0,
+                                                   self._initial_snapshot):
+            self.starts.append(start)
+            self.blocks.append(block)
+            self.outputs.append(output)
+            self.snapshots.append(snapshot)
+            start += len(block)
+        self.reconverted = len(self.blocks)
+
+# Replace the input lines ``start:end`` (indices as in a slice) with
+# `new_lines` and update the conversion.
+#
+# Return the change of the output as tuple ``(start, end, lines)``: the
+# converted lines ``start:end`` of the previous output are replaced by
+# `lines`. ::
+
+    def update(self, start, end, new_lines):
+        """Replace input lines `start`:`end` with `new_lines`,
+        return changed output as (start, end, lines) tuple
+        """
+        new_lines = list(new_lines)
+        old_lines = self.lines[start:end]
+        self.lines[start:end] = new_lines
+        try:
+            return self._update(start, end, new_lines)
+        except:
+            self.lines[start:start+len(new_lines)] = old_lines
+            raise
+
+    def _update(self, start, end, new_lines):
+        if not self.incremental:
+            old_length = len(self.outputs[0])
+            self._convert_all()
+            self.reconverted = 1
+            return (0, old_length, self.outputs[0])
+
+# Find the block containing the first edited line and start with the
+# preceding one::
+
+        import bisect
+        index = max(bisect.bisect_right(self.starts, start) - 2, 0)
+        if index:
+            snapshot = self.snapshots[index-1]
+        else:
+            snapshot = self._initial_snapshot
+        line = self.starts[index:index+1] and self.starts[index] or 0
+
+# Convert until a block ends at an old block boundary after the edit and the
+# converter is in the same state as after the old block::
+
+        delta = len(new_lines) - (end - start)
+        edit_end = start + len(new_lines)
+        (blocks, outputs, snapshots) = ([], [], [])
+        old = index
+        resync = len(self.blocks)
+        for (block, output, snapshot) in self._convert_blocks(line, snapshot):
+            blocks.append(block)
+            outputs.append(output)
+            snapshots.append(snapshot)
+            line += len(block)
+            if line < edit_end:
+                continue
+            while (old < len(self.blocks) and
+                   self.starts[old] + len(self.blocks[old]) < line - delta):
+                old += 1
+            if (old < len(self.blocks)
+                and self.starts[old] + len(self.blocks[old]) == line - delta
+                and self.snapshots[old] == snapshot):
+                resync = old + 1
+                break
+
+# Replace the re-converted blocks and shift the start of the following ones::
+
+        output_start = sum([len(output) for output in self.outputs[:index]])
+        output_end = output_start + sum([len(output) for output
+                                         in self.outputs[index:resync]])
+        starts = []
+        line = self.starts[index:index+1] and self.starts[index] or 0
+        for block in blocks:
+            starts.append(line)
+            line += len(block)
+        self.starts[index:] = starts + [block_start + delta for block_start
+                                        in self.starts[resync:]]
+        self.blocks[index:resync] = blocks
+        self.outputs[index:resync] = outputs
+        self.snapshots[index:resync] = snapshots
+        self.reconverted = len(blocks)
+        new_output = []
+        for output in outputs:
+            new_output.extend(output)
+        return (output_start, output_end, new_output)
+
 
 # Use cases
 # ---------
 #
+# .. _convert_file:
+#
+# convert_file
+# ~~~~~~~~~~~~
+#
+# Convert `infile` to `outfile`. This is the default action of `main`_. Keyword
+# arguments are passed on to `open_streams`_ and the converter
+# instantiation. ::
+
+def convert_file(infile='-', outfile='-', replace=False, cache_dir=None,
+                 write_source_map=False, **keyw):
+    """Convert `infile` and write the result to `outfile`
+    """
+
+# With `write_source_map`, the `SourceMap`_ of the conversion is written to a
+# file next to the output (``<outfile>.map``)::
+
+    if write_source_map and outfile != '-':
+        keyw["source_map"] = SourceMap()
+        cache_dir = None
+
+# With a `cache_dir`, conversion of files is done by `_convert_cached`.
+# It returns False, if the existing `outfile` is up to date::
+
+    if cache_dir and '-' not in (infile, outfile):
+        if _convert_cached(infile, outfile, cache_dir, **keyw):
+            print "extract written to", outfile
+        else:
+            print "extract up to date:", outfile
+
+# Otherwise, open in- and output streams and convert (see `convert_stream`_)::
+
+    else:
+        (data, out_stream) = open_streams(infile, outfile, **keyw)
+        try:
+            convert_stream(data, out_stream, **keyw)
+        except:
+            if isinstance(out_stream, AtomicFile):
+                out_stream.discard()
+            raise
+        if out_stream is not sys.stdout:
+            print "extract written to", out_stream.name
+            out_stream.close()
+        if keyw.get("source_map") is not None:
+            stream = file(outfile + ".map", "w")
+            stream.write("%s\n" % keyw["source_map"])
+            stream.close()
+
+# If input and output are from files, set the modification time (`mtime`) of
+# the output file to the one of the input file to indicate that the contained
+# information is equal. [#]_ ::
+
+    if outfile != '-':
+        try:
+            os.utime(outfile, (os.path.getatime(outfile),
+                               os.path.getmtime(infile))
+                    )
+        except OSError:
+            pass
+
+    ## print "mtime", os.path.getmtime(infile),  infile
+    ## print "mtime", os.path.getmtime(outfile), outfile
+
+
+# .. [#] Make sure the corresponding file object (here `out_stream`) is
+#        closed, as otherwise the change will be overwritten when `close` is
+#        called afterwards (either explicitly or at program exit).
+#
+#
+# Rename the infile to a backup copy if ``--replace`` is set::
+
+    if replace:
+        os.rename(infile, infile + "~")
+
+# _convert_cached
+# ~~~~~~~~~~~~~~~
+#
+# Convert `infile` using a `ConversionCache`_ in `cache_dir`.
+#
+# If the cache holds a conversion of the input data with the current settings
+# and `outfile` has exactly this content, nothing is written (regardless of
+# the `overwrite` setting and the modification times). Otherwise the
+# `outfile` is written (subject to the `overwrite` setting) from the cache or
+# from a new conversion that is stored in the cache.
+#
+# Return True if `outfile` was written::
+
+def _convert_cached(infile, outfile, cache_dir, **keyw):
+    """Convert `infile` to `outfile` with content-hash cache in `cache_dir`
+    """
+    cache = ConversionCache(cache_dir)
+    converter = get_converter(None, **keyw)
+    key = cache.key(_iter_chunks(infile), converter)
+    entry = cache.path(key)
+    if (os.path.exists(entry) and os.path.exists(outfile)
+        and _same_content(entry, outfile)):
+        return False
+    (data, out_stream) = open_streams(infile, outfile, **keyw)
+    try:
+        try:
+            if not os.path.exists(entry):
+                converter.data = data
+                cache.put(key, converter)
+            for chunk in _iter_chunks(entry):
+                out_stream.write(chunk)
+        except:
+            if isinstance(out_stream, AtomicFile):
+                out_stream.discard()
+            raise
+    finally:
+        data.close()
+        out_stream.close()
+    return True
+
+# .. _convert_many:
+#
+# convert_many
+# ~~~~~~~~~~~~
+#
+# Convert a list of input files (e.g. the result of `find_sources`_).
+# Keyword arguments are option values common to all files, they are completed
+# with `PylitOptions.complete_values`_ for every file separately (i.e. output
+# name, direction and language are guessed per file).
+#
+# With `jobs` > 1, the conversions are distributed over a pool of worker
+# processes (``jobs=0`` starts one process per CPU). This requires the
+# `multiprocessing` module (Python >= 2.6), otherwise the files are converted
+# one after the other.
+#
+# An error converting one file is reported but does not abort the batch.
+# Return a list of ``(infile, error)`` tuples for the failed conversions::
+
+def convert_many(infiles, jobs=1, **keyw):
+    """Convert every file in `infiles`, return list of failures
+    """
+    tasks = [(infile, keyw) for infile in infiles]
+    pool = None
+    if jobs not in (None, 1) and len(tasks) > 1:
+        try:
+            import multiprocessing
+        except ImportError:
+            pass
+        else:
+            pool = multiprocessing.Pool(jobs or None)
+    if pool is None:
+        results = (_convert_task(task) for task in tasks)
+    else:
+        results = pool.imap(_convert_task, tasks)
+    failures = []
+    try:
+        for (infile, error) in results:
+            if error is not None:
+                _report_failure(infile, error)
+                failures.append((infile, error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return failures
+
+# The worker function converts one file. It must be defined at module level,
+# so that it can be sent to a pool process::
+
+def _convert_task(task):
+    """Convert one file, return ``(infile, error)``"""
+    (infile, keyw) = task
+    values = OptionValues(keyw)
+    values.infile = infile
+    try:
+        values = PylitOptions().complete_values(values)
+        convert_file(**values.as_dict())
+    except Exception, ex:
+        return (infile, ex)
+    return (infile, None)
+
+# Report a failed conversion in the style of `main`_::
+
+def _report_failure(infile, ex):
+    if isinstance(ex, EnvironmentError) and ex.strerror:
+        print "%s: %s %s" % (ex.__class__.__name__, ex.filename, ex.strerror)
+    else:
+        print "%s: %s %s" % (ex.__class__.__name__, infile, ex)
+
+
+# .. _Watcher:
+#
+# Watcher
+# ~~~~~~~
+#
+# A resident process keeping the text and code versions of a set of files in
+# sync (command line option ``--watch``).
+#
+# The watched `paths` are files or directories. Every file given is watched
+# together with its counterpart (the output file name guessed by
+# `PylitOptions.complete_values`_). Directories are searched for text sources
+# with `find_sources`_ and for code sources that already have a text version,
+# new files are picked up while watching.
+#
+# For every changed pair, the direction is determined with `is_newer`_: the
+# newer file is converted. As `convert_file`_ sets the modification time of
+# the output file to the one of the input file, a converted pair is in sync
+# and the output file does not trigger a conversion in the other direction.
+# If one file of a pair is deleted, the pair is ignored (instead of restoring
+# the deleted file from its counterpart).
+#
+# Changes are "debounced": a pair is converted only after its files were
+# unchanged for `delay` seconds, so that a conversion does not start while an
+# editor is still writing a file. When started, all pairs out of sync are
+# converted immediately.
+#
+# Changes are detected by polling ``os.stat`` every `interval` seconds. If the
+# `pyinotify` module is available (Linux), the watcher sleeps until the
+# kernel reports a change in a watched directory instead.
+#
+# Keyword arguments are option values for the conversion (see
+# `convert_many`_). ::
+
+class Watcher(object):
+    """Watch text and code files, convert the newer file of changed pairs
+    """
+    def __init__(self, paths, delay=0.5, interval=1.0, **keyw):
+        self.paths = paths
+        self.delay = delay
+        self.interval = interval
+        self.keyw = keyw
+        self._state = {}       # pair -> [signature, time of change]
+        self._notifier = None
+
+# Return the ``(textfile, codefile)`` pair for `path` or None, if `path` is
+# no literate source (i.e. the direction or language cannot be guessed)::
+
+    def pair(self, path):
+        """Return (textfile, codefile) tuple for `path`"""
+        values = OptionValues(self.keyw)
+        values.infile = path
+        values.outfile = None
+        values.txt2code = None
+        try:
+            values = PylitOptions().complete_values(values)
+        except KeyError:
+            return None
+        if values.txt2code:
+            return (values.infile, values.outfile)
+        return (values.outfile, values.infile)
+
+# Return the sorted list of watched pairs::
+
+    def pairs(self):
+        """Return list of (textfile, codefile) tuples to watch"""
+        pairs = set()
+        for path in self.paths:
+            if not os.path.isdir(path):
+                pairs.add(self.pair(path))
+                continue
+            for source in find_sources([path], True, **self._extensions()):
+                pairs.add(self.pair(source))
+            for source in find_sources([path], False, **self._extensions()):
+                pair = self.pair(source)
+                if pair is not None and os.path.exists(pair[0]):
+                    pairs.add(pair)
+        pairs.discard(None)
+        return sorted(pairs)
+
+    def _extensions(self):
+        return {"text_extensions": self.keyw.get("text_extensions"),
+                "languages": self.keyw.get("languages")}
+
+# The signature of a pair changes with the size or modification time of any
+# of its files::
+
+    def signature(self, pair):
+        """Return tuple of (mtime, size) tuples (or None) for files in `pair`
+        """
+        signature = []
+        for path in pair:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime, stat.st_size))
+        return tuple(signature)
+
+# Check the watched files at time `now` (default: the current time). Convert
+# the pairs that changed at least `delay` seconds ago and return the list of
+# the converted files. Failures are reported in the style of `convert_many`_
+# but do not end the watch::
+
+    def check(self, now=None):
+        """Convert changed pairs, return list of converted input files"""
+        import time
+        if now is None:
+            now = time.time()
+        converted = []
+        for pair in self.pairs():
+            signature = self.signature(pair)
+            state = self._state.get(pair)
+            if state is None:
+                self._state[pair] = state = [None, None] # convert now
+            elif state[0] != signature:
+                if None in signature and None not in state[0]:
+                    state[1] = False # a file was deleted: ignore the pair
+                else:
+                    state[1] = now
+            state[0] = signature
+            if state[1] is False or (state[1] is not None
+                                     and now - state[1] < self.delay):
+                continue
+            infile = self.sync(pair)
+            if infile is not None:
+                converted.append(infile)
+            state[:] = [self.signature(pair), False]
+        return converted
+
+# Convert the newer file of `pair`. Return the input file name or None, if
+# the files are in sync::
+
+    def sync(self, pair):
+        """Convert newer file of (textfile, codefile) `pair`"""
+        (textfile, codefile) = pair
+        newer = is_newer(textfile, codefile)
+        if newer is None:
+            return None
+        if newer:
+            (infile, outfile) = (textfile, codefile)
+        else:
+            (infile, outfile) = (codefile, textfile)
+        keyw = dict(self.keyw, outfile=outfile, txt2code=newer)
+        (infile, error) = _convert_task((infile, keyw))
+        if error is not None:
+            _report_failure(infile, error)
+        return infile
+
+# Are there changes waiting for the debounce delay? ::
+
+    def pending(self):
+        return [state for state in self._state.values()
+                if state[1] not in (None, False)]
+
+# Wait for changes (at most `timeout` seconds, None: until something
+# happens)::
+
+    def wait(self, timeout=None):
+        if self._notifier is None:
+            import time
+            time.sleep(timeout or self.interval)
+            return
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        if self._notifier.check_events(timeout):
+            self._notifier.read_events()
+            self._notifier.process_events()
+
+# Set up the `pyinotify` notifier (if available) for the directories of the
+# watched paths. Editors often replace a file instead of writing it, hence
+# the directories and not the files are watched::
+
+    def _init_notifier(self):
+        try:
+            import pyinotify
+        except ImportError:
+            return
+        manager = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+                | pyinotify.IN_CREATE | pyinotify.IN_DELETE)
+        for path in self.paths:
+            if not os.path.isdir(path):
+                path = os.path.dirname(os.path.abspath(path))
+            manager.add_watch(path, mask, rec=True, auto_add=True)
+        self._notifier = pyinotify.Notifier(manager,
+                                            default_proc_fun=lambda event: None)
+
+# Watch until interrupted with Ctrl-C::
+
+    def run(self):
+        """Check for changes and convert until interrupted"""
+        self._init_notifier()
+        try:
+            while True:
+                self.check()
+                if self.pending():
+                    self.wait(self.delay)
+                else:
+                    self.wait()
+        except KeyboardInterrupt:
+            pass
+        if self._notifier is not None:
+            self._notifier.stop()
+
+
 # run_doctest
 # ~~~~~~~~~~~
 # ::
 
-def run_doctest(infile="-", txt2code=True,
-                globs={}, verbose=False, optionflags=0, **keyw):
+def run_doctest(infile="-", txt2code=True, globs={}, verbose=False,
+                optionflags=0, cache_dir=None, **keyw):
     """run doctest on the text source
     """
 
@@ -1587,6 +3739,16 @@ def run_doctest(infile="-", txt2code=True,
         docencoding = match.group(1)
         docstring = docstring.decode(docencoding)
 
+# Skip the tests if they passed before (see `doctest cache`_)::
+
+    if cache_dir:
+        cache = ConversionCache(cache_dir)
+        key = _doctest_key(docstring, optionflags)
+        tries = _get_doctest_result(cache, key)
+        if tries is not None:
+            print "0 failures in %d tests (cached)" % tries
+            return 0, tries
+
 # Use the doctest Advanced API to run all doctests in the source text::
 
     test = DocTestParser().get_doctest(docstring, globs, name="",
@@ -1597,8 +3759,270 @@ def run_doctest(infile="-", txt2code=True,
     # give feedback also if no failures occurred
     if not runner.failures:
         print "%d failures in %d tests"%(runner.failures, runner.tries)
+        if cache_dir:
+            _put_doctest_result(cache, key, runner.tries)
     return runner.failures, runner.tries
 
+# .. _doctest cache:
+#
+# Doctest cache
+# ~~~~~~~~~~~~~
+#
+# Passed doctests are recorded in a `ConversionCache`_. The key is a hash of
+# the text source (after conversion), the doctest option flags and the Python
+# version. The cache entry lists the local modules imported while running the
+# tests with a hash of their source. A cached result is only used if none of
+# these modules changed.
+#
+# Local modules are all modules in ``sys.modules`` with a source file, except
+# the standard library and installed packages (in a ``site-packages`` or
+# ``dist-packages`` directory). This includes modules imported indirectly,
+# from anywhere in ``sys.path``, and modules imported before the test (which
+# may be more than needed but never misses a dependency). Changes of the
+# standard library and installed packages do not invalidate cached results.
+# ::
+
+def _doctest_key(docstring, optionflags=0):
+    if isinstance(docstring, unicode):
+        docstring = docstring.encode("utf-8")
+    return _hexdigest("doctest", repr((_version, sys.version, optionflags)),
+                      docstring)
+
+# Return a list of the source files of the local modules::
+
+def _local_modules():
+    stdlib = os.path.join(os.path.dirname(os.path.realpath(os.__file__)), "")
+    paths = set()
+    for module in sys.modules.values():
+        path = getattr(module, "__file__", None)
+        if not path:
+            continue
+        path = os.path.realpath(path)
+        if path.endswith((".pyc", ".pyo")):
+            path = path[:-1]
+        if ("site-packages" in path or "dist-packages" in path
+            or path.startswith(stdlib) or not os.path.isfile(path)):
+            continue
+        paths.add(path)
+    return sorted(paths)
+
+# The cache entry is a line with the number of tests followed by lines with
+# hash and path of the local modules::
+
+def _put_doctest_result(cache, key, tries):
+    entry = ["%d\n" % tries]
+    for path in _local_modules():
+        entry.append("%s %s\n" % (_hexdigest(*_iter_chunks(path)), path))
+    cache.put(key, entry)
+
+# Return the number of tests of a valid cache entry or None::
+
+def _get_doctest_result(cache, key):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    lines = entry.splitlines()
+    for line in lines[1:]:
+        (digest, path) = line.split(" ", 1)
+        try:
+            if _hexdigest(*_iter_chunks(path)) != digest:
+                return None
+        except IOError: # deleted module
+            return None
+    return int(lines[0])
+
+# .. _run_doctests:
+#
+# run_doctests
+# ~~~~~~~~~~~~
+#
+# Run the doctests of many files and return a list of `DoctestResult`_
+# instances (in the order of `infiles`).
+#
+# Every file is tested in a separate process, so that tests cannot influence
+# each other (via imported modules, ``sys.path`` or global state). Up to
+# `jobs` processes run in parallel (``jobs=0``: one per CPU). A test process
+# exceeding the `timeout` (in seconds) is terminated.
+#
+# Keyword arguments are option values common to all files, they are completed
+# with `PylitOptions.complete_values`_ for every file separately (cf.
+# `convert_many`_). Without the `multiprocessing` module (Python < 2.6), the
+# files are tested one after the other in this process and `timeout` is
+# ignored. ::
+
+def run_doctests(infiles, jobs=1, timeout=None, **keyw):
+    """Run doctests in `infiles`, return list of `DoctestResult` instances
+    """
+    import time
+    if jobs is None:
+        jobs = 1
+    elif jobs < 0:
+        raise ValueError("number of jobs must not be negative: %d" % jobs)
+    try:
+        import multiprocessing
+    except ImportError:
+        return [_doctest_file(infile, keyw) for infile in infiles]
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    results = {}
+    pending = list(infiles)
+    pending.reverse()
+    running = [] # (infile, process, connection, start time)
+    while pending or running:
+        while pending and len(running) < jobs:
+            infile = pending.pop()
+            (receiver, sender) = multiprocessing.Pipe(False)
+            process = multiprocessing.Process(target=_doctest_worker,
+                                              args=(infile, keyw, sender))
+            process.start()
+            sender.close()
+            running.append((infile, process, receiver, time.time()))
+
+# Wait for results. A process that ends without sending a result crashed::
+
+        for task in running[:]:
+            (infile, process, receiver, start) = task
+            seconds = time.time() - start
+            if receiver.poll(0.01 / len(running)):
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    result = DoctestResult(infile, seconds=seconds,
+                                error="test process exited with code %s"
+                                      % process.exitcode)
+            elif timeout is not None and seconds > timeout:
+                process.terminate()
+                result = DoctestResult(infile, seconds=seconds,
+                            error="timeout after %g seconds" % timeout)
+            else:
+                continue
+            process.join()
+            receiver.close()
+            running.remove(task)
+            results[infile] = result
+    return [results[infile] for infile in infiles]
+
+# The test of one file runs in a child process and sends its result to the
+# parent. Output (the failure report of the doctest runner) is collected in
+# the result::
+
+def _doctest_worker(infile, keyw, connection):
+    connection.send(_doctest_file(infile, keyw))
+    connection.close()
+
+def _doctest_file(infile, keyw):
+    """Run the doctests in `infile`, return a `DoctestResult`"""
+    import time
+    from StringIO import StringIO
+    values = OptionValues(keyw)
+    values.infile = infile
+    result = DoctestResult(infile)
+    start = time.time()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        try:
+            values = PylitOptions().complete_values(values)
+            (result.failures, result.tries) = run_doctest(**values.as_dict())
+        except Exception, ex:
+            result.error = "%s: %s" % (ex.__class__.__name__, ex)
+    finally:
+        result.output = sys.stdout.getvalue()
+        sys.stdout = stdout
+    result.seconds = time.time() - start
+    return result
+
+# .. _DoctestResult:
+#
+# DoctestResult
+# ~~~~~~~~~~~~~
+#
+# The outcome of the doctests of one file: number of `failures` and `tries`,
+# the `output` of the doctest runner, an `error` message (if the tests could
+# not be completed) and the run time in `seconds`::
+
+class DoctestResult(object):
+    """Result of the doctests of one file"""
+    def __init__(self, infile, failures=0, tries=0, output="", error=None,
+                 seconds=0.0):
+        self.__dict__.update(infile=infile, failures=failures, tries=tries,
+                             output=output, error=error, seconds=seconds)
+
+    def ok(self):
+        return not (self.failures or self.error)
+    ok = property(ok)
+
+    def __repr__(self):
+        return "<DoctestResult %s: %d failures in %d tests%s>" % (
+            self.infile, self.failures, self.tries,
+            self.error and " (%s)" % self.error or "")
+
+# Print the output of failed tests and a summary::
+
+def report_doctests(results, stream=sys.stdout):
+    """Print an aggregated report of doctest `results`"""
+    failures = tries = errors = 0
+    for result in results:
+        failures += result.failures
+        tries += result.tries
+        if result.ok:
+            continue
+        stream.write(result.output)
+        if result.error:
+            errors += 1
+            stream.write("%s: %s\n" % (result.infile, result.error))
+    stream.write("%d failures in %d tests in %d files" % (failures, tries,
+                                                          len(results)))
+    if errors:
+        stream.write(", %d files with errors" % errors)
+    stream.write("\n")
+
+# .. _write_junit_xml:
+#
+# write_junit_xml
+# ~~~~~~~~~~~~~~~
+#
+# Write `results` in the JUnit XML format understood by most CI servers. Every
+# file is a test case::
+
+def write_junit_xml(results, path):
+    """Write a JUnit XML report of doctest `results` to `path`"""
+    from xml.sax.saxutils import escape, quoteattr
+    def text(string):
+        if isinstance(string, unicode):
+            string = string.encode("utf-8")
+        return string
+    stream = file(path, "w")
+    try:
+        stream.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        stream.write('<testsuite name="pylit.doctest" tests="%d" '
+                     'failures="%d" errors="%d" time="%.3f">\n' % (
+            len(results),
+            len([result for result in results
+                 if result.failures and not result.error]),
+            len([result for result in results if result.error]),
+            sum([result.seconds for result in results])))
+        for result in results:
+            stream.write('  <testcase classname="doctest" name=%s '
+                         'time="%.3f"' % (quoteattr(text(result.infile)),
+                                          result.seconds))
+            if result.ok:
+                stream.write('/>\n')
+                continue
+            if result.error:
+                element = "error"
+                message = result.error
+            else:
+                element = "failure"
+                message = "%d failures in %d tests" % (result.failures,
+                                                       result.tries)
+            stream.write('>\n    <%s message=%s>%s</%s>\n  </testcase>\n' % (
+                element, quoteattr(text(message)),
+                escape(text(result.output)), element))
+        stream.write('</testsuite>\n')
+    finally:
+        stream.close()
+
 
 # diff
 # ~~~~
@@ -1617,22 +4041,31 @@ def diff(infile='-', outfile='-', txt2code=True, **keyw):
     instream = file(infile)
     # for diffing, we need a copy of the data as list::
     data = instream.readlines()
-    # convert
-    converter = get_converter(data, txt2code, **keyw)
-    new = converter()
 
     if outfile != '-' and os.path.exists(outfile):
+        # convert
+        converter = get_converter(data, txt2code, **keyw)
+        new = converter()
         outstream = file(outfile)
         old = outstream.readlines()
         oldname = outfile
         newname = "<conversion of %s>"%infile
     else:
+        # test the round-trip conversion block-wise (see `verify_roundtrip`_)
         old = data
         oldname = infile
-        # back-convert the output data
-        converter = get_converter(new, not txt2code)
-        new = converter()
         newname = "<round-conversion of %s>"%infile
+        mismatch = verify_roundtrip(data, txt2code, **keyw)
+        if mismatch is None:
+            print oldname
+            print newname
+            print "no differences found"
+            return False
+        print "%s: %s" % (infile, mismatch)
+        new = get_converter(data, txt2code, **keyw)()
+        # back-convert the output data (with the same options)
+        converter = get_converter(new, not txt2code, **keyw)
+        new = converter()
 
     # find and print the differences
     is_different = False
@@ -1651,22 +4084,656 @@ def diff(infile='-', outfile='-', txt2code=True, **keyw):
     return is_different
 
 
+# .. _check:
+#
+# check
+# ~~~~~
+#
+# Test if `outfile` is up to date, i.e. equal to the conversion of `infile`.
+# This is a fast alternative to `diff`_ for the usual case of no differences:
+# The converted data is compared chunk by chunk to the content of `outfile`
+# while it is produced, neither file is read completely and the comparison
+# stops at the first mismatch. Only if the files differ, the differences are
+# reported with `diff`_.
+#
+# Return True if the `outfile` is missing or differs (like `diff`_). ::
+
+def check(infile='-', outfile='-', txt2code=True, use_mmap=False, **keyw):
+    """Test if `outfile` is the conversion of `infile`, report differences
+    """
+    if outfile == '-' or not os.path.exists(outfile):
+        print "%s: missing (conversion of %s)" % (outfile, infile)
+        return True
+    if use_mmap:
+        instream = MappedFile(infile)
+    else:
+        instream = file(infile)
+    outstream = file(outfile)
+    try:
+        converter = get_converter(instream, txt2code, **keyw)
+        is_different = not _same_output(converter, outstream)
+    finally:
+        instream.close()
+        outstream.close()
+    if is_different:
+        diff(infile, outfile, txt2code, **keyw)
+    return is_different
+
+# Compare the `chunks` of a conversion (strings of any length) with the
+# content of `stream`::
+
+def _same_output(chunks, stream):
+    read = stream.read
+    for chunk in chunks:
+        if read(len(chunk)) != chunk:
+            return False
+    return not read(1)
+
+# .. _check_many:
+#
+# check_many
+# ~~~~~~~~~~
+#
+# `check`_ a list of files. Only differences are reported, followed by a
+# summary. Keyword arguments are completed for every file (cf.
+# `convert_many`_). Return the list of files that are not up to date.
+#
+# With ``function=verify``, the round-trip conversion of every file is
+# tested with `verify`_ instead. ::
+
+def check_many(infiles, function=check, **keyw):
+    """Check every file in `infiles`, return list of files out of sync
+    """
+    differing = []
+    for infile in infiles:
+        values = OptionValues(keyw)
+        values.infile = infile
+        try:
+            values = PylitOptions().complete_values(values)
+            if function(**values.as_dict()):
+                differing.append(infile)
+        except Exception, ex:
+            _report_failure(infile, ex)
+            differing.append(infile)
+    print "%d of %d files out of sync" % (len(differing), len(infiles))
+    return differing
+
+
+# .. _verify_roundtrip:
+#
+# verify_roundtrip
+# ~~~~~~~~~~~~~~~~
+#
+# Test that converting `data` (an iterable of lines) forth and back
+# reproduces it. Return None if it does, otherwise a `RoundtripMismatch`_
+# describing the first block that is not reproduced.
+#
+# The conversions are chained iterators and the result is compared line by
+# line with the input, stopping at the first difference. ::
+
+def verify_roundtrip(data, txt2code=True, **keyw):
+    """Convert `data` forth and back, return first mismatching block or None
+    """
+    from itertools import izip_longest
+    data = list(data)
+    converter = get_converter(data, txt2code, **keyw)
+    roundtrip = iter(get_converter(converter, not txt2code, **keyw))
+    result = []
+    for (lineno, (line, new_line)) in enumerate(izip_longest(data,
+                                                             roundtrip)):
+        if new_line is not None:
+            result.append(new_line)
+        if line != new_line:
+            break
+    else:
+        return None
+
+# Only if there is a difference, the round trip is repeated recording the
+# blocks of the input with their states. Lines may be added or stripped
+# (e.g. a missing code block marker), so the line numbers of input and result
+# differ after such a block. The result is split into blocks in the same way
+# as the input. If this fails (the number of blocks changed), the block
+# boundaries are translated with the `SourceMap`_ of both conversions. The
+# first block that is not reproduced is reported. A difference after the
+# last block (missing or additional lines) is attributed to the last block::
+
+    converter = get_converter(data, txt2code, **keyw)
+    converter.profiler = _StateRecorder(converter)
+    converter.source_map = forward = SourceMap()
+    back_converter = get_converter(converter(), not txt2code, **keyw)
+    back_converter.source_map = backward = SourceMap()
+    result = back_converter()
+    states = converter.profiler.states
+    result_blocks = [len(block) for block in tokenize_blocks(result)]
+    (start, result_start) = (0, 0)
+    for (index, (state, length)) in enumerate(states):
+        end = start + length
+        if index == len(states) - 1:
+            (end, result_end) = (len(data), len(result))
+        elif len(result_blocks) == len(states):
+            result_end = result_start + result_blocks[index]
+        else:
+            result_end = backward.output_offset(forward.output_offset(end))
+        if data[start:end] != result[result_start:result_end]:
+            break
+        (start, result_start) = (end, result_end)
+    return RoundtripMismatch(index, state, start, end, data[start:end],
+                             result[result_start:result_end])
+
+# The blocks and their states are recorded with the profiling hooks of the
+# converter (cf. `Profiler`_): after every call of `set_state`, the new state
+# and the length of the block are stored::
+
+class _StateRecorder(object):
+    def __init__(self, converter):
+        self.converter = converter
+        self.states = [] # (state, number of lines)
+
+    def iterate(self, stage, iterable):
+        return iterable
+
+    def call(self, stage, function, *args):
+        result = function(*args)
+        if stage == "set_state":
+            self.states.append((self.converter.state, len(args[0])))
+        return result
+
+# .. _RoundtripMismatch:
+#
+# RoundtripMismatch
+# ~~~~~~~~~~~~~~~~~
+#
+# The first block of a document that is not reproduced by a round trip:
+# block number, state, line range (`start` is the index of the first line,
+# `end` the index after the last line), and the lines of the block in the
+# input (`expected`) and after the round trip (`got`)::
+
+class RoundtripMismatch(object):
+    """Report of a block that changes in a round-trip conversion"""
+    def __init__(self, index, state, start, end, expected, got):
+        self.__dict__.update(index=index, state=state, start=start, end=end,
+                             expected=expected, got=got)
+
+    def __str__(self):
+        return "block %d (%s, lines %d-%d) changes in round-trip conversion" % (
+            self.index + 1, self.state, self.start + 1, self.end)
+
+# .. _verify:
+#
+# verify
+# ~~~~~~
+#
+# Command line interface to `verify_roundtrip`_: test the file `infile` and
+# report the first block that changes. Return True if there are differences
+# (like `diff`_)::
+
+def verify(infile='-', txt2code=True, **keyw):
+    """Test if round-trip conversion of `infile` reproduces it"""
+    instream = file(infile)
+    try:
+        mismatch = verify_roundtrip(instream, txt2code, **keyw)
+    finally:
+        instream.close()
+    if mismatch is None:
+        return False
+    _report_mismatch(infile, mismatch)
+    return True
+
+def _report_mismatch(infile, mismatch):
+    import difflib
+    print "%s: %s" % (infile, mismatch)
+    for line in difflib.unified_diff(mismatch.expected, mismatch.got,
+                                     fromfile=infile,
+                                     tofile="<round-conversion of %s>" % infile,
+                                     n=len(mismatch.expected)):
+        print line,
+
+
 # execute
 # ~~~~~~~
 #
 # Works only for python code.
 #
-# Does not work with `eval`, as code is not just one expression. ::
+# Does not work with `eval`, as code is not just one expression.
+#
+# The code is compiled with the input file name (for tracebacks) and executed
+# as script, i.e. in a new namespace with ``__name__ == "__main__"``. Text
+# sources are converted and compiled by `compile_text`_. With a `cache_dir`,
+# the code object is cached there, so that re-running an unchanged script
+# skips conversion and compilation. Without, nothing is written (executing
+# a script has no side effects on the source tree, which may be read-only)::
 
-def execute(infile="-", txt2code=True, **keyw):
+def execute(infile="-", txt2code=True, cache_dir=None, **keyw):
     """Execute the input file. Convert first, if it is a text source.
     """
-
-    data = file(infile)
     if txt2code:
-        data = str(Text2Code(data, **keyw))
+        code = compile_text(infile, cache_dir, cache=bool(cache_dir), **keyw)
+    else:
+        stream = file(infile)
+        try:
+            code = compile(stream.read(), infile, "exec")
+        finally:
+            stream.close()
     # print "executing " + options.infile
-    exec data
+    namespace = {"__name__": "__main__", "__file__": infile,
+                 "__builtins__": __builtin__}
+    exec code in namespace
+
+
+# .. _compile_text:
+#
+# compile_text
+# ~~~~~~~~~~~~
+#
+# Convert the literate Python source `infile` and compile it. Tracebacks
+# refer to `infile` (the line numbers of text and code source are the same).
+#
+# The code object is cached in a bytecode file, by default
+# ``__pycache__/<name>.pyc`` next to the source (``foo.py.txt`` is cached in
+# ``__pycache__/foo.py.txt.pyc``). With `cache_dir`, the bytecode files of all
+# sources are kept in this directory (named after a hash of the source path).
+#
+# The bytecode file starts with the "magic number" of the Python version and
+# a hash of the source and the converter settings (`_conversion_key`). If
+# both match, the code object is loaded without conversion and compilation.
+#
+# Problems writing the bytecode file are ignored (as by Python's own import),
+# ``sys.dont_write_bytecode`` is respected. With ``cache=False``, no bytecode
+# file is used. ::
+
+def compile_text(infile, cache_dir=None, cache=True, **keyw):
+    """Return code object of the literate Python source `infile`
+    """
+    import imp, marshal
+    stream = file(infile)
+    try:
+        source = stream.read()
+    finally:
+        stream.close()
+    keyw.setdefault("language", "python")
+    converter = Text2Code(source.splitlines(True), **keyw)
+    if not cache:
+        return compile("".join(converter), infile, "exec")
+    header = imp.get_magic() + _conversion_key([source], converter)
+    cache_file = _bytecode_path(infile, cache_dir)
+    try:
+        stream = file(cache_file, 'rb')
+        try:
+            bytecode = stream.read()
+        finally:
+            stream.close()
+        if bytecode.startswith(header):
+            return marshal.loads(bytecode[len(header):])
+    except (IOError, EOFError, ValueError, TypeError):
+        pass # missing or invalid cache file
+    code = compile("".join(converter), infile, "exec")
+    if not sys.dont_write_bytecode:
+        _write_bytecode(cache_file, header + marshal.dumps(code))
+    return code
+
+# Return the path of the bytecode file for `infile`::
+
+def _bytecode_path(infile, cache_dir=None):
+    if cache_dir:
+        return os.path.join(cache_dir,
+                            _hexdigest(os.path.abspath(infile)) + ".pyc")
+    (directory, name) = os.path.split(infile)
+    return os.path.join(directory, "__pycache__", name + ".pyc")
+
+# Write the bytecode file via a temporary file (cf. `ConversionCache`_)::
+
+def _write_bytecode(path, bytecode):
+    tmppath = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        stream = file(tmppath, 'wb')
+        try:
+            stream.write(bytecode)
+        finally:
+            stream.close()
+        try:
+            os.rename(tmppath, path)
+        except OSError: # existing file (Windows)
+            os.remove(tmppath)
+    except EnvironmentError:
+        pass
+
+
+# .. _LiterateImporter:
+#
+# LiterateImporter
+# ~~~~~~~~~~~~~~~~
+#
+# An import hook (PEP 302 finder and loader for ``sys.meta_path``) to import
+# literate Python modules directly from the text source: With the hook
+# installed, ``import foo`` imports ``foo.py.txt`` (or the package
+# ``foo/__init__.py.txt``) if it is found on ``sys.path``. The code is
+# compiled with `compile_text`_, i.e. repeated imports of an unchanged module
+# load the cached bytecode.
+#
+# Keyword arguments are passed to `compile_text`_ (e.g. `cache_dir` or
+# converter settings).
+#
+# A regular module or package takes precedence if it is found in the same or
+# an earlier ``sys.path`` directory, so that a converted ``foo.py`` in the
+# same directory is imported by the standard mechanism. ::
+
+class LiterateImporter(object):
+    """Find and load literate Python modules (text sources)
+    """
+    def __init__(self, text_extensions=None, **keyw):
+        if text_extensions is None:
+            text_extensions = defaults.text_extensions
+        self.text_extensions = text_extensions
+        self.keyw = keyw
+        self._sources = {} # fullname -> (path of text source, is_package)
+
+# Return the path of the text source of the module or package `name` in
+# `directory` (or None)::
+
+    def find_source(self, directory, name):
+        for ext in self.text_extensions:
+            path = os.path.join(directory, name + ".py" + ext)
+            if os.path.isfile(path):
+                return (path, False)
+            path = os.path.join(directory, name, "__init__.py" + ext)
+            if os.path.isfile(path):
+                return (path, True)
+        return None
+
+# Finder interface: `path` is None for top-level modules and the package
+# ``__path__`` for submodules. If a text source is found, check with `imp`
+# for a regular module that is found first::
+
+    def find_module(self, fullname, path=None):
+        """Return self, if `fullname` is a literate module"""
+        name = fullname.rpartition(".")[2]
+        if path is None:
+            path = sys.path
+        for (index, directory) in enumerate(path):
+            if not isinstance(directory, basestring):
+                continue
+            source = self.find_source(directory or os.curdir, name)
+            if source is None:
+                continue
+            import imp
+            try:
+                (stream, pathname, description) = imp.find_module(
+                                                    name, path[:index+1])
+            except ImportError:
+                self._sources[fullname] = source
+                return self
+            if stream:
+                stream.close()
+            return None
+        return None
+
+# Loader interface: execute the code in a new module object (or the existing
+# one on reload). A module that fails to initialize is removed again::
+
+    def load_module(self, fullname):
+        """Import the literate module `fullname`"""
+        import imp
+        try:
+            (path, is_package) = self._sources.pop(fullname)
+        except KeyError:
+            raise ImportError("no literate module %r" % fullname)
+        code = compile_text(path, **self.keyw)
+        is_reload = fullname in sys.modules
+        module = sys.modules.setdefault(fullname, imp.new_module(fullname))
+        module.__file__ = path
+        module.__loader__ = self
+        if is_package:
+            module.__path__ = [os.path.dirname(path)]
+            module.__package__ = fullname
+        else:
+            module.__package__ = fullname.rpartition(".")[0]
+        try:
+            exec code in module.__dict__
+        except:
+            if not is_reload:
+                del(sys.modules[fullname])
+            raise
+        return module
+
+# Install a `LiterateImporter`_ in ``sys.meta_path`` (once) and return it.
+# Keyword arguments are passed to the importer::
+
+def install_import_hook(**keyw):
+    """Enable import of literate Python modules"""
+    for importer in sys.meta_path:
+        if isinstance(importer, LiterateImporter):
+            return importer
+    importer = LiterateImporter(**keyw)
+    sys.meta_path.append(importer)
+    return importer
+
+def uninstall_import_hook():
+    """Disable import of literate Python modules"""
+    sys.meta_path[:] = [importer for importer in sys.meta_path
+                        if not isinstance(importer, LiterateImporter)]
+
+
+# .. _conversion server:
+#
+# ConversionServer
+# ~~~~~~~~~~~~~~~~
+#
+# A resident process answering conversion requests, e.g. from editor plug-ins
+# (command line option ``--serve``). This saves the start of a new process
+# per request, the settings (compiled regular expressions and filters, see
+# `Dialect`_) are kept between requests.
+#
+# The server speaks JSON-RPC 2.0 over standard input and output or a Unix
+# domain socket (``--socket``). Every request and response is a JSON object
+# on one line. Documents are passed as strings (`text`), not as files.
+#
+# Methods (parameters as JSON object):
+#
+# convert
+#   Convert `text`. Returns ``{"output": <str>, "txt2code": <bool>}``.
+#
+# diff
+#   Compare the conversion of `text` to `output` (the existing document in
+#   the other format) or, without `output`, test the round trip. Returns
+#   ``{"different": <bool>, "diff": <unified diff>}``.
+#
+# check
+#   Test if `output` is the conversion of `text` (cf. `check`_). Returns
+#   ``{"up_to_date": <bool>}``.
+#
+# doctest
+#   Run the doctests in `text` (converted to the text format, if it is a
+#   code source). Returns ``{"failures": <int>, "tries": <int>,
+#   "output": <report>}``.
+#
+# Further parameters are option values for the conversion (e.g. `txt2code`,
+# `language` or `comment_string`) and override the options given to the
+# server. If `txt2code` is not given, the direction and language are guessed
+# from the optional `filename` (see `PylitOptions.complete_values`_), e.g.
+#
+# .. code-block:: js
+#
+#   {"jsonrpc": "2.0", "id": 1, "method": "convert",
+#    "params": {"text": "# comment\nx = 1\n", "filename": "foo.py"}}
+#
+# ::
+
+class ConversionServer(object):
+    """JSON-RPC server for conversion requests"""
+
+    def __init__(self, **keyw):
+        import threading
+        self.keyw = keyw
+        try:
+            import json
+        except ImportError: # Python < 2.6
+            import simplejson as json
+        self.json = json
+        self.doctest_lock = threading.Lock()
+
+# Complete the option values of a request (`params` without the document
+# buffers) and return them as dictionary::
+
+    def options(self, params):
+        values = OptionValues(self.keyw)
+        values.__dict__.update(params)
+        values.infile = params.get("filename") or ""
+        values.outfile = None
+        for key in ("filename", "text", "output"):
+            values.__dict__.pop(key, None)
+        return PylitOptions().complete_values(values).as_dict()
+
+# The methods. `text` and `output` are split into lines for the converters::
+
+    def rpc_convert(self, text, **params):
+        options = self.options(params)
+        output = "".join(get_converter(text.splitlines(True), **options))
+        return {"output": output, "txt2code": options["txt2code"]}
+
+    def rpc_diff(self, text, output=None, **params):
+        import difflib
+        options = self.options(params)
+        txt2code = options.pop("txt2code")
+        data = text.splitlines(True)
+        if output is None:
+            mismatch = verify_roundtrip(data, txt2code, **options)
+            if mismatch is None:
+                return {"different": False, "diff": ""}
+            old = data
+            new = get_converter(get_converter(data, txt2code, **options),
+                                not txt2code, **options)()
+            names = ("<text>", "<round-conversion>")
+        else:
+            old = output.splitlines(True)
+            new = get_converter(data, txt2code, **options)()
+            names = ("<output>", "<conversion>")
+        delta = "".join(difflib.unified_diff(old, new, *names))
+        return {"different": bool(delta), "diff": delta}
+
+    def rpc_check(self, text, output, **params):
+        from StringIO import StringIO
+        converter = get_converter(text.splitlines(True), **self.options(params))
+        return {"up_to_date": _same_output(converter, StringIO(output))}
+
+    def rpc_doctest(self, text, verbose=False, optionflags=0, **params):
+        from doctest import DocTestParser, DocTestRunner
+        options = self.options(params)
+        if options["txt2code"] is False:
+            options["add_missing_marker"] = False
+            text = "".join(Code2Text(text.splitlines(True), **options))
+        name = params.get("filename") or "<text>"
+        test = DocTestParser().get_doctest(text, {}, name, name, 0)
+        report = []
+        runner = DocTestRunner(verbose=verbose, optionflags=optionflags)
+        # the runner redirects `sys.stdout` of the process, doctests of
+        # concurrent requests (`socket_server`) must not run at the same time
+        self.doctest_lock.acquire()
+        try:
+            runner.run(test, out=report.append)
+        finally:
+            self.doctest_lock.release()
+        return {"failures": runner.failures, "tries": runner.tries,
+                "output": "".join(report)}
+
+# Handle one request (a JSON string) and return the response (a JSON string)
+# or None for a notification (request without "id"), also if it fails. Errors
+# are reported with the JSON-RPC error codes. The parameters are checked
+# against the signature of the method before the call, so that a `TypeError`
+# raised by the method is reported as server error::
+
+    def handle(self, request):
+        """Process a JSON-RPC request, return the response"""
+        try:
+            request = self.json.loads(request)
+        except ValueError:
+            return self.error(None, -32700, "Parse error")
+        if not isinstance(request, dict) or "method" not in request:
+            return self.error(None, -32600, "Invalid Request")
+        id = request.get("id")
+        response = self.call(request.get("method"), request.get("params", {}))
+        if "id" not in request:
+            return None
+        if "error" in response:
+            return self.error(id, *response["error"])
+        return self.json.dumps({"jsonrpc": "2.0", "id": id,
+                                "result": response["result"]})
+
+    def call(self, name, params):
+        """Call method `name`, return {"result": ...} or {"error": ...}"""
+        method = getattr(self, "rpc_" + str(name), None)
+        if method is None:
+            return {"error": (-32601, "Method not found")}
+        if not isinstance(params, dict):
+            return {"error": (-32602, "Invalid params: object expected")}
+        params = dict([(str(key), value) for (key, value) in params.items()])
+        problem = self.check_params(method, params)
+        if problem:
+            return {"error": (-32602, "Invalid params: %s" % problem)}
+        try:
+            return {"result": method(**params)}
+        except Exception, ex:
+            return {"error": (-32000, "%s: %s" % (ex.__class__.__name__, ex))}
+
+    def check_params(self, method, params):
+        """Return a problem of the `params` for `method` or None"""
+        from inspect import getargspec
+        (args, varargs, varkw, defaults) = getargspec(method)
+        args = args[1:] # self
+        required = args[:len(args) - len(defaults or ())]
+        missing = [arg for arg in required if arg not in params]
+        if missing:
+            return "missing %s" % ", ".join(missing)
+        if varkw is None:
+            unknown = [key for key in params if key not in args]
+            if unknown:
+                return "unexpected %s" % ", ".join(sorted(unknown))
+        return None
+
+    def error(self, id, code, message):
+        return self.json.dumps({"jsonrpc": "2.0", "id": id,
+                                "error": {"code": code, "message": message}})
+
+# Serve requests from `instream` (one per line) until it ends::
+
+    def serve(self, instream=sys.stdin, outstream=sys.stdout):
+        """Answer requests from `instream` on `outstream`"""
+        for line in iter(instream.readline, ""):
+            if not line.strip():
+                continue
+            response = self.handle(line)
+            if response is not None:
+                outstream.write(response + "\n")
+                outstream.flush()
+
+# Serve clients connecting to the Unix domain socket at `path`. Every
+# connection is handled in a thread (e.g. one per editor)::
+
+    def socket_server(self, path):
+        """Return a server listening on the Unix domain socket `path`"""
+        import SocketServer
+        conversion_server = self
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                conversion_server.serve(self.rfile, self.wfile)
+        class Server(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+            daemon_threads = True
+        if os.path.exists(path):
+            os.remove(path)
+        return Server(path, Handler)
+
+    def serve_socket(self, path):
+        """Answer requests on the Unix domain socket `path`"""
+        server = self.socket_server(path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        os.remove(path)
 
 
 # main
@@ -1687,6 +4754,11 @@ def execute(infile="-", txt2code=True, **keyw):
 
 def main(args=sys.argv[1:], **defaults):
     """%prog [options] INFILE [OUTFILE]
+       %prog [options] --recursive PATH [PATH ...]
+       %prog [options] --watch PATH [PATH ...]
+       %prog [options] --doctest PATH [PATH ...]
+       %prog [options] --check PATH [PATH ...]
+       %prog [options] --verify PATH [PATH ...]
 
     Convert between (reStructured) text source with embedded code,
     and code source with embedded documentation (comment blocks)
@@ -1694,9 +4766,91 @@ def main(args=sys.argv[1:], **defaults):
     The special filename '-' stands for standard in and output.
     """
 
-# Parse and complete the options::
+# Parse the options::
 
-    options = PylitOptions()(args, **defaults)
+    option_parser = PylitOptions()
+    options = option_parser.parse_args(args, **defaults)
+
+# Time the conversion stages with a Profiler_ and report to stderr when done.
+# Profiling data is collected in this process, so batch conversion with
+# profiling runs serially::
+
+    if options.profile:
+        options.profiler = Profiler()
+        options.jobs = 1
+        try:
+            return _main(option_parser, options)
+        finally:
+            options.profiler.report(sys.stderr)
+    return _main(option_parser, options)
+
+def _main(option_parser, options):
+# Answer conversion requests until the input ends (see `conversion
+# server`_)::
+
+    if options.serve:
+        keyw = options.as_dict()
+        for key in ("serve", "socket", "infile", "outfile"):
+            keyw.pop(key, None)
+        server = ConversionServer(**keyw)
+        if options.socket:
+            server.serve_socket(options.socket)
+        else:
+            server.serve()
+        return
+
+# Keep the text and code versions of the given files and directories in sync
+# (see Watcher_)::
+
+    if options.watch:
+        keyw = options.as_dict()
+        del(keyw["watch"], keyw["infiles"])
+        keyw.pop("recursive", None)
+        Watcher(options.infiles, **keyw).run()
+        return
+
+# Run the doctests or check many files or all sources in directories (see
+# `run_doctests`_ and `check_many`_). Exit with an error if a test fails
+# (e.g. for use in a Makefile or CI script)::
+
+    infiles = options.infiles or []
+    if ((options.doctest or options.check or options.verify)
+        and (options.recursive or len(infiles) > 1
+             or [path for path in infiles if os.path.isdir(path)])):
+        keyw = options.as_dict()
+        for key in ("infiles", "recursive", "infile", "outfile"):
+            keyw.pop(key, None)
+        infiles = find_sources(infiles, options.txt2code,
+                               options.text_extensions, options.languages)
+        if options.check or options.verify:
+            if options.verify:
+                keyw["function"] = verify
+            if check_many(infiles, **keyw):
+                sys.exit(1)
+            return []
+        results = run_doctests(infiles, **keyw)
+        report_doctests(results)
+        if options.junit_xml:
+            write_junit_xml(results, options.junit_xml)
+        if [result for result in results if not result.ok]:
+            sys.exit(1)
+        return results
+
+# Batch conversion of all sources in the given files and directories. The
+# options are completed separately for every input file by `convert_many`_::
+
+    if options.recursive:
+        keyw = options.as_dict()
+        del(keyw["recursive"], keyw["infiles"])
+        infiles = find_sources(options.infiles, options.txt2code,
+                               options.text_extensions, options.languages)
+        if convert_many(infiles, **keyw):
+            sys.exit(1)
+        return
+
+# Complete the options with "intelligent guesses"::
+
+    options = option_parser.complete_values(options)
     # print "infile", repr(options.infile)
 
 # Special actions with early return::
@@ -1707,54 +4861,27 @@ def main(args=sys.argv[1:], **defaults):
     if options.diff:
         return diff(**options.as_dict())
 
+    if options.check:
+        if check(**options.as_dict()):
+            sys.exit(1)
+        return False
+
+    if options.verify:
+        if verify(**options.as_dict()):
+            sys.exit(1)
+        return False
+
     if options.execute:
         return execute(**options.as_dict())
 
-# Open in- and output streams::
+# Convert the input file (see `convert_file`_)::
 
     try:
-        (data, out_stream) = open_streams(**options.as_dict())
+        convert_file(**options.as_dict())
     except IOError, ex:
         print "IOError: %s %s" % (ex.filename, ex.strerror)
         sys.exit(ex.errno)
 
-# Get a converter instance::
-
-    converter = get_converter(data, **options.as_dict())
-
-# Convert and write to out_stream::
-
-    out_stream.write(str(converter))
-
-    if out_stream is not sys.stdout:
-        print "extract written to", out_stream.name
-        out_stream.close()
-
-# If input and output are from files, set the modification time (`mtime`) of
-# the output file to the one of the input file to indicate that the contained
-# information is equal. [#]_ ::
-
-        try:
-            os.utime(options.outfile, (os.path.getatime(options.outfile),
-                                       os.path.getmtime(options.infile))
-                    )
-        except OSError:
-            pass
-
-    ## print "mtime", os.path.getmtime(options.infile),  options.infile
-    ## print "mtime", os.path.getmtime(options.outfile), options.outfile
-
-
-# .. [#] Make sure the corresponding file object (here `out_stream`) is
-#        closed, as otherwise the change will be overwritten when `close` is
-#        called afterwards (either explicitly or at program exit).
-#
-#
-# Rename the infile to a backup copy if ``--replace`` is set::
-
-    if options.replace:
-        os.rename(options.infile, options.infile + "~")
-
 
 # Run main, if called from the command line::
 
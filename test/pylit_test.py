@@ -35,6 +35,7 @@
 
 from pprint import pprint
 import operator
+from StringIO import StringIO
 from pylit import *
 import nose
 
@@ -345,6 +346,312 @@ class test_TextCodeConverter(object):
         assert len(textblocks) == 7, "text sample has 7 blocks"
         assert reduce(operator.__add__, textblocks) == textdata
 
+## ::
+
+    def test_tokenize_blocks(self):
+        """should expand tabs and collect the same blocks as collect_blocks"""
+        data = textdata + ["\tindented by tab\n"]
+        blocks = [block for block in tokenize_blocks(data)]
+        soll = [block for block in collect_blocks(expandtabs_filter(data))]
+        print blocks
+        assert blocks == soll
+
+    def test_tokenize_blocks_indents(self):
+        """blocks should carry the indent of every line (None if blank)"""
+        block = tokenize_blocks(["  a\n", "b\n", "  \n", "\n"]).next()
+        print block.indents
+        assert block.indents == [2, 0, None, None]
+
+    def test_block_setitem(self):
+        """assigning to an item should update the indents"""
+        block = Block([".. header\n", "  code\n"])
+        assert block.indents == [0, 2]
+        block[0] = "    header\n"
+        assert block.indents == [4, 2]
+
+    def test_block_sequence(self):
+        """a block should store its lines in one string but act as a list"""
+        lines = ["a\n", "  b\n", "\n"]
+        block = Block(lines)
+        assert block.buffer == "a\n  b\n\n"
+        assert list(block.ends) == [2, 6, 7]
+        assert len(block) == 3
+        assert block[1] == "  b\n"
+        assert block[-1] == "\n"
+        assert block[1:] == lines[1:]
+        assert block == lines
+        assert list(block) == lines
+        assert not hasattr(block, "__dict__")
+        # the lines are created once per block (until released)
+        assert block.lines() is block.lines()
+        lines_list = block.lines()
+        block.release()
+        assert block.lines() is not lines_list
+        assert block.lines() == lines
+        try:
+            block[-4]
+            assert False, "should raise IndexError"
+        except IndexError:
+            pass
+
+    def test_block_list_methods(self):
+        """custom handlers may use a block like a list"""
+        lines = ["a\n", "  b\n", "\n"]
+        block = Block(lines)
+        assert block + ["c\n"] == lines + ["c\n"]
+        assert ["c\n"] + block == ["c\n"] + lines
+        assert "  b\n" in block
+        assert block.index("\n") == 2
+        assert block.count("a\n") == 1
+        block.append("  c\n")
+        block.insert(0, "x\n")
+        del block[1]
+        assert block == ["x\n", "  b\n", "\n", "  c\n"]
+        assert block.indents == [0, 2, None, 2]
+        assert block.pop() == "  c\n"
+        block.remove("x\n")
+        block.extend(["d\n"])
+        block += ["e\n"]
+        assert isinstance(block, Block)
+        assert block == ["  b\n", "\n", "d\n", "e\n"]
+        assert list(block.ends) == [4, 5, 7, 9]
+
+    def test_tokenize_blocks_buffer(self):
+        blocks = list(tokenize_blocks(["a\n", "\tb\n", "\n", "c\n"]))
+        assert [block.buffer for block in blocks] == ["a\n        b\n\n",
+                                                      "c\n"]
+        assert [block.indents for block in blocks] == [[0, 8, None], [0]]
+        assert blocks[0] == ["a\n", "        b\n", "\n"]
+
+    def test_line_indents(self):
+        converter = TextCodeConverter(textdata)
+        assert converter.line_indents(["  a", "", "b"]) == [2, None, 0]
+
+
+## Dialect
+## =======
+##
+## ::
+
+class test_Dialect(object):
+    """Test the caching of converter settings"""
+
+    def test_get_dialect(self):
+        dialect = get_dialect(Text2Code, "python")
+        assert dialect.comment_string == "# "
+        assert dialect.code_block_marker == "::"
+        assert dialect.marker_regexp.search("text::")
+        assert dialect is get_dialect(Text2Code, "python")
+        assert dialect is not get_dialect(Code2Text, "python")
+        assert dialect is not get_dialect(Text2Code, "python", "## ")
+
+    def test_converters_share_dialect(self):
+        converter1 = Text2Code(textdata)
+        converter2 = Text2Code(codedata)
+        assert converter1.dialect is converter2.dialect
+        assert converter1.marker_regexp is converter2.marker_regexp
+
+    def test_converter_from_dialect(self):
+        dialect = get_dialect(Text2Code, "python", code_block_marker=":: *")
+        converter = Text2Code(textdata, dialect=dialect)
+        assert converter.code_block_marker == ":: *"
+        assert converter.marker_regexp is dialect.marker_regexp
+
+    def test_filter_registration(self):
+        """new filters should be used by new converters"""
+        assert Code2Text(codedata, language="dialect").preprocessor \
+               == identity_filter
+        defaults.preprocessors["dialect2text"] = r2l_filter
+        try:
+            converter = Code2Text(codedata, language="dialect")
+            assert converter.preprocessor == r2l_filter
+        finally:
+            del(defaults.preprocessors["dialect2text"])
+
+
+## Profiler
+## --------
+##
+## A counter as timer makes the measured times predictable::
+
+class test_Profiler(object):
+    """Test the timing of conversion stages"""
+
+    def setUp(self):
+        self.ticks = iter(range(1000)).next
+        self.profiler = Profiler(timer=lambda: float(self.ticks()))
+
+    def test_call(self):
+        result = self.profiler.call("stage", operator.add, 1, 2)
+        assert result == 3
+        assert self.profiler.stats == {"stage": [1, 1.0]}
+
+    def test_iterate(self):
+        items = list(self.profiler.iterate("stage", "abc"))
+        assert items == ["a", "b", "c"]
+        # 3 items + the final StopIteration, one tick each
+        assert self.profiler.stats == {"stage": [3, 4.0]}
+
+    def test_exclusive_time(self):
+        """time of nested stages is not counted in the outer stage"""
+        inner = self.profiler.iterate("inner", "ab")
+        outer = self.profiler.iterate("outer", inner)
+        assert list(outer) == ["a", "b"]
+        stats = self.profiler.stats
+        assert stats["inner"] == [2, 3.0]
+        assert stats["outer"][0] == 2
+        assert stats["outer"][1] == 6.0 # 3 steps of 5 ticks - 3 inner ticks
+
+    def test_converter(self):
+        profiler = Profiler()
+        output = Text2Code(textdata, profiler=profiler)()
+        assert output == codedata
+        for stage in ("read", "preprocessor", "convert", "postprocessor",
+                      "tokenize_blocks", "set_state", "header_handler",
+                      "documentation_handler", "code_block_handler"):
+            assert stage in profiler.stats, stage
+        assert profiler.stats["read"][0] == len(textdata)
+
+    def test_report(self):
+        self.profiler.call("stage", len, "abc")
+        stream = StringIO()
+        self.profiler.report(stream)
+        lines = stream.getvalue().splitlines()
+        assert lines[0].split() == ["stage", "calls", "seconds", "%"]
+        assert lines[1].split() == ["stage", "1", "1.0000", "100.0"]
+
+
+## SourceMap
+## ---------
+##
+## ::
+
+class test_SourceMap(object):
+    """Test the line number map between input and output"""
+
+    def test_identity(self):
+        source_map = SourceMap()
+        assert Text2Code(textdata, source_map=source_map)() == codedata
+        assert str(source_map) == str(len(textdata))
+        assert source_map.to_output(5) == 5
+        assert source_map.to_input(5) == 5
+        assert source_map.to_output(len(textdata) + 1) is None
+
+    def test_strip(self):
+        source_map = SourceMap()
+        output = Text2Code(textdata, source_map=source_map, strip=True)()
+        print source_map
+        assert str(source_map) == "3,2:0,2:0,2,2:0,3,1:0"
+        for (lineno, line) in enumerate(output):
+            assert line.strip() in textdata[source_map.to_input(lineno+1)-1]
+        assert source_map.to_output(4) is None # stripped text
+
+    def test_add_missing_marker(self):
+        source_map = SourceMap()
+        output = Code2Text(["# doc\n", "\n", "x = 1\n"],
+                           source_map=source_map)()
+        assert output == ["doc\n", "\n", "::\n", "\n", "  x = 1\n"]
+        assert str(source_map) == "2,1:3"
+        assert [source_map.to_output(i) for i in (1, 2, 3)] == [1, 2, 5]
+        assert [source_map.to_input(i) for i in (3, 4, 5)] == [None, None, 3]
+
+    def test_output_offset(self):
+        """block boundaries are translated with the alignment rules"""
+        source_map = SourceMap.parse("2,1:3,2:0")
+        assert [source_map.output_offset(i) for i in range(7)] \
+               == [0, 1, 2, 5, 5, 5, 6]
+
+    def test_parse(self):
+        source_map = SourceMap.parse("40,3:0,12\n")
+        assert source_map.segments == [[40, 40], [3, 0], [12, 12]]
+        assert str(source_map) == "40,3:0,12"
+        assert source_map.to_output(44) == 41
+        assert source_map.to_input(41) == 44
+
+    def test_reuse(self):
+        """a converter starts a new map with every conversion"""
+        source_map = SourceMap()
+        converter = Text2Code(textdata, source_map=source_map)
+        converter()
+        converter()
+        assert str(source_map) == str(len(textdata))
+
+
+## IncrementalConverter
+## --------------------
+##
+## ::
+
+class test_IncrementalConverter(object):
+    """Test the block-wise update of conversions"""
+
+    def setUp(self):
+        self.data = textdata * 3
+        self.converter = IncrementalConverter(self.data)
+
+    def check_update(self, start, end, new_lines):
+        old_output = self.converter()
+        (out_start, out_end, lines) = self.converter.update(start, end,
+                                                            new_lines)
+        new_data = self.data[:start] + new_lines + self.data[end:]
+        expected = Text2Code(new_data)()
+        assert self.converter() == expected
+        assert old_output[:out_start] + lines + old_output[out_end:] \
+               == expected
+        self.data = new_data
+
+    def test_convert(self):
+        assert self.converter() == Text2Code(self.data)()
+        assert self.converter.reconverted == len(self.converter.blocks)
+
+    def test_change_text(self):
+        self.check_update(3, 4, ["changed text\n"])
+        assert self.converter.reconverted <= 2
+
+    def test_insert_code_block(self):
+        self.check_update(20, 20, ["new block::\n", "\n", "  x = 1\n",
+                                   "\n"])
+        assert self.converter.reconverted < len(self.converter.blocks)
+
+    def test_delete_lines(self):
+        self.check_update(3, 12, [])
+
+    def test_change_header(self):
+        """changing the first line changes the state of the first block"""
+        self.check_update(0, 1, ["no header any more\n"])
+
+    def test_code2text(self):
+        converter = IncrementalConverter(codedata, txt2code=False)
+        converter.update(4, 5, ["# new comment\n"])
+        new_data = codedata[:4] + ["# new comment\n"] + codedata[5:]
+        assert converter() == Code2Text(new_data)()
+
+    def test_error(self):
+        """a failing update leaves the document unchanged"""
+        output = self.converter()
+        try:
+            self.converter.update(12, 12, [" badly_indented_code\n"])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("should raise ValueError")
+        assert self.converter.lines == self.data
+        assert self.converter() == output
+
+    def test_filters(self):
+        """with language filters, the document is converted as a whole"""
+        defaults.preprocessors["text2incremental"] = r2l_filter
+        try:
+            converter = IncrementalConverter(textdata,
+                                             language="incremental")
+            (start, end, lines) = converter.update(3, 4, ["new\n"])
+        finally:
+            del(defaults.preprocessors["text2incremental"])
+        assert converter.incremental is False
+        assert (start, end) == (0, len(codedata))
+        assert lines == converter()
+
+
 ## Text2Code
 ## =========
 ##
@@ -528,7 +835,7 @@ class test_Text2Code(object):
         """should return filter from filter_set for language"""
         postprocessor = self.converter.get_filter("postprocessors", "css")
         print postprocessor
-        assert postprocessor == dumb_c_postprocessor
+        assert postprocessor == c_comment_postprocessor
 
     def test_get_filter_nonexisting_language_filter(self):
         """should return identity_filter if language has no filter in set"""
@@ -878,7 +1185,7 @@ class test_Code2Text(object):
         """should return filter from filter_set for language"""
         preprocessor = self.converter.get_filter("preprocessors", "css")
         print preprocessor
-        assert preprocessor == dumb_c_preprocessor
+        assert preprocessor == c_comment_preprocessor
 
     def test_get_filter_postprocessor(self):
         """should return Code2Text postprocessor for language"""
@@ -1191,6 +1498,145 @@ def test_dumb_c_postprocessor():
     print "soll: %r"%css_code
     assert output == css_code
 
+## ::
+
+c_code = ['/* A multi-line comment\n',
+          ' * with decoration\n',
+          ' */\n',
+          '\n',
+          'char *s = "/* no comment";\n',
+          'int i; /* trailing comment\n',
+          '/* inside a comment */\n',
+          '*/\n',
+          "char c = '\"'; // \"\n",
+          '/* a comment\n',
+          '   indented */\n']
+
+c_filtered_code = ['// A multi-line comment\n',
+                   '// with decoration\n',
+                   '\n',
+                   'char *s = "/* no comment";\n',
+                   'int i; /* trailing comment\n',
+                   '/* inside a comment */\n',
+                   '*/\n',
+                   "char c = '\"'; // \"\n",
+                   '// a comment\n',
+                   '// indented\n']
+
+## ::
+
+def test_c_comment_preprocessor():
+    """convert `C` to `C++` comments, skip strings and other comments"""
+    output = [line for line in c_comment_preprocessor(css_code)]
+    assert output == css_filtered_code
+    output = [line for line in c_comment_preprocessor(c_code)]
+    print "ist:  %r"%output
+    print "soll: %r"%c_filtered_code
+    assert output == c_filtered_code
+
+## ::
+
+def test_c_comment_postprocessor():
+    """convert runs of `C++` comments to one `C` comment"""
+    output = [line for line in c_comment_postprocessor(c_filtered_code)]
+    print "ist:  %r"%output
+    assert output == ['/* A multi-line comment\n',
+                      '   with decoration */\n'] + c_code[3:]
+    output = [line for line in c_comment_postprocessor(css_filtered_code)]
+    assert output[:2] == ['/* import the default Docutils style sheet\n',
+                          '   --------------------------------------- */\n']
+
+## ::
+
+def test_c_comment_roundtrip():
+    """normalised `C` code should survive conversion to text and back"""
+    code = ['/* A comment\n',
+            '   with two lines\n',
+            '\n',
+            '   and a second paragraph:: */\n',
+            '\n',
+            'char *s = "/* no comment";\n']
+    text = Code2Text(code, language="c")()
+    print text
+    assert text[:4] == ['A comment\n', 'with two lines\n', '\n',
+                        'and a second paragraph::\n']
+    output = Text2Code(text, language="c")()
+    print output
+    assert output == code
+
+## Filter chains
+## -------------
+##
+## ::
+
+def upper_line(line):
+    return line.upper()
+
+def strip_line(line):
+    return line.strip() + "\n"
+
+upper_filter = line_filter(upper_line)
+strip_filter = line_filter(strip_line)
+
+## ::
+
+def test_line_filter():
+    """a line filter should apply its function to every line"""
+    assert list(upper_filter(["a\n", "b\n"])) == ["A\n", "B\n"]
+    assert upper_filter.line_function is upper_line
+    assert upper_filter.__name__ == "upper_line"
+
+def test_FilterChain():
+    """adjacent line filters should be fused into one stage"""
+    chain = FilterChain([r2l_filter, upper_filter, strip_filter,
+                         x2u_filter])
+    assert len(chain.stages) == 3
+    assert chain.stages[0] is r2l_filter
+    assert chain.stages[2] is x2u_filter
+    output = list(chain([" red\n", "rose \n"]))
+    print output
+    assert output == ["LED\n", "LOSE\n"]
+    assert chain == FilterChain(chain.filters)
+    assert chain != FilterChain([upper_filter])
+    assert "upper_line" in chain.__name__
+    chain = FilterChain([upper_filter, strip_filter, upper_filter,
+                         strip_filter])
+    assert len(chain.stages) == 2
+    assert chain.stages[1] is strip_filter
+    assert list(chain([" a \n"])) == ["A\n"]
+
+def test_compose_filters():
+    assert compose_filters([]) is identity_filter
+    assert compose_filters([r2l_filter]) is r2l_filter
+    assert isinstance(compose_filters([r2l_filter, l2r_filter]), FilterChain)
+
+def test_register_language():
+    """register_language should collect settings and filters in defaults"""
+    register_language("testlang", extensions=[".tl"], comment_string="; ",
+                      preprocessors=[upper_filter],
+                      postprocessors=[strip_filter])
+    try:
+        defaults.preprocessors["testlang2text"].append(strip_filter)
+        assert defaults.languages[".tl"] == "testlang"
+        assert defaults.comment_strings["testlang"] == "; "
+        converter = Code2Text(["; text\n"], language="testlang")
+        assert converter.preprocessor == FilterChain([upper_filter,
+                                                      strip_filter])
+        assert converter() == ["TEXT\n"]
+        # composed filters are cached, converters share the dialect
+        converter2 = Code2Text(["; text\n"], language="testlang")
+        assert converter2.preprocessor is converter.preprocessor
+        assert converter2.dialect is converter.dialect
+        assert Text2Code([], language="testlang").postprocessor is strip_filter
+        register_language("testlang", postprocessors=[upper_filter])
+        assert defaults.postprocessors["text2testlang"] == [strip_filter,
+                                                            upper_filter]
+    finally:
+        del(defaults.languages[".tl"])
+        del(defaults.comment_strings["testlang"])
+        del(defaults.preprocessors["testlang2text"])
+        del(defaults.postprocessors["text2testlang"])
+
 
 
 ## ::
@@ -18,6 +18,8 @@
 """pylit_test.py: test the "literal python" module's user interface"""
 
 from pprint import pprint
+import shutil, tempfile
+from StringIO import StringIO
 from pylit import *
 from pylit_test import (text, stripped_text, textdata, 
                         code, stripped_code, codedata)
@@ -105,6 +107,29 @@ class test_PylitOptions:
         values = self.options.parse_args(["--language", "slang"])
         assert values.language == "slang"
 
+    def test_parse_args_plain(self):
+        """a plain conversion should not set up the option parser"""
+        values = self.options.parse_args(["text.txt", "-"])
+        assert values.infile == "text.txt"
+        assert values.outfile == "-"
+        assert self.options._parser is None
+        values = self.options.parse_args(["-c", "code.py"])
+        assert values.txt2code is False
+        assert self.options._parser is not None
+
+    def test_deferred_imports(self):
+        """importing pylit should not import optional or heavy modules"""
+        import subprocess
+        script = ("import sys; import pylit; print [name for name in "
+                  "('optparse', 'difflib', 'doctest', 'pkg_resources', "
+                  "'pylit_elisp') if name in sys.modules]")
+        rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        child = subprocess.Popen([sys.executable, "-c", script],
+                                 stdout=subprocess.PIPE, cwd=rootdir)
+        output = child.communicate()[0]
+        print output
+        assert output.strip() == "[]"
+
     def test_parse_args_comment_string(self):
        # command line arg should appear in values
         values = self.options.parse_args(["--comment-string=% "])
@@ -122,6 +147,13 @@ class test_PylitOptions:
         pprint(values.as_dict())
         assert values.code_block_marker == '.. test-dir::'
 
+    def test_parse_args_recursive(self):
+        """with --recursive, all positional args are input paths"""
+        values = self.options.parse_args(["--recursive", "doc", "foo.py.txt"])
+        assert values.infiles == ["doc", "foo.py.txt"]
+        assert values.infile is None
+        assert values.outfile is None
+
     def test_get_outfile_name(self):
         """should return a sensible outfile name given an infile name"""
         # return stdout for stdin
@@ -312,6 +344,25 @@ class test_Streams(IOTests):
         outfile = file(self.outpath, 'r')
         assert outfile.read() == text
 
+    def test_open_streams_mmap(self):
+        (instream, outstream) = open_streams(self.txtpath, use_mmap=True)
+        assert isinstance(instream, MappedFile)
+        assert instream.name == self.txtpath
+        assert list(instream) == textdata
+        assert instream.read() == text
+        instream.close()
+
+    def test_mapped_file_no_trailing_newline(self):
+        file(self.outpath, 'w').write("line 1\nline 2")
+        assert list(MappedFile(self.outpath)) == ["line 1\n", "line 2"]
+
+    def test_mapped_file_empty(self):
+        file(self.outpath, 'w').close()
+        mapped = MappedFile(self.outpath)
+        assert list(mapped) == []
+        assert mapped.read() == ""
+        mapped.close()
+
     def test_open_streams_no_infile(self):
         """should exit with usage info if no infile given"""
         try:
@@ -320,6 +371,66 @@ class test_Streams(IOTests):
         except IOError:
             pass
 
+    def tmpfiles(self):
+        """return leftover temporary files of atomic output"""
+        return [name for name in os.listdir("/tmp")
+                if name.startswith(".pylit_test.out.")]
+
+    def test_open_streams_atomic(self):
+        file(self.outpath, 'w').write("old content")
+        (instream, outstream) = open_streams(self.txtpath, self.outpath,
+                                             overwrite="yes", atomic=True)
+        assert isinstance(outstream, AtomicFile)
+        assert outstream.name == self.outpath
+        outstream.write(text)
+        outstream.flush()
+        assert self.get_output() == "old content"
+        outstream.close()
+        assert self.get_output() == text
+        assert self.tmpfiles() == []
+
+    def test_atomic_file_discard(self):
+        file(self.outpath, 'w').write("old content")
+        outstream = AtomicFile(self.outpath)
+        outstream.write(text)
+        outstream.discard()
+        outstream.close() # no effect after discard
+        assert self.get_output() == "old content"
+        assert self.tmpfiles() == []
+
+    def test_atomic_file_mode(self):
+        file(self.outpath, 'w').close()
+        os.chmod(self.outpath, 0640)
+        outstream = AtomicFile(self.outpath, buffer_size=1024, fsync=True)
+        outstream.write(text)
+        outstream.close()
+        assert os.stat(self.outpath).st_mode & 0777 == 0640
+        assert self.get_output() == text
+
+    def test_atomic_file_new(self):
+        outstream = AtomicFile(self.outpath)
+        outstream.write(text)
+        outstream.close()
+        assert self.get_output() == text
+
+    def test_conversion_error_keeps_outfile(self):
+        file(self.txtpath, 'w').write("..    #!/usr/bin/env python\n"
+                                      "\n"
+                                      "  print 'hello world'\n")
+        file(self.outpath, 'w').write("old content")
+        try:
+            main(infile=self.txtpath, outfile=self.outpath, overwrite="yes")
+            assert False, "wrong indent did not raise ValueError"
+        except ValueError:
+            pass
+        assert self.get_output() == "old content"
+        assert self.tmpfiles() == []
+
+    def test_no_atomic_option(self):
+        main(["--no-atomic", "--buffer-size=1024",
+              self.txtpath, self.outpath])
+        assert self.get_output() == code
+
 ## get_converter
 ## ~~~~~~~~~~~~~
 
@@ -343,6 +454,161 @@ class test_Run_Doctest(IOTests):
         (failures, tests) = run_doctest(self.codepath, txt2code=False)
         assert (failures, tests) == (0, 0)
 
+class test_Run_Doctests(object):
+    """Doctests of many files run in separate processes"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.passing = self.write("a.py.txt", ">>> 1 + 1\n2\n")
+        self.failing = self.write("b.py.txt", ">>> 1 + 1\n3\n")
+        self.isolated = self.write("c.py.txt", ">>> import os\n"
+                                   ">>> os.environ['PYLIT_TEST'] = '1'\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        stream = file(path, 'w')
+        stream.write(content)
+        stream.close()
+        return path
+
+    def test_run_doctests(self):
+        results = run_doctests([self.passing, self.failing], jobs=2)
+        print results
+        assert [result.infile for result in results] == [self.passing,
+                                                         self.failing]
+        assert [(result.failures, result.tries) for result in results] \
+               == [(0, 1), (1, 1)]
+        assert results[0].ok and not results[1].ok
+        assert "Expected:" in results[1].output
+
+    def test_isolation(self):
+        results = run_doctests([self.isolated])
+        assert results[0].ok
+        assert "PYLIT_TEST" not in os.environ
+
+    def test_timeout(self):
+        slow = self.write("slow.py.txt", ">>> import time\n"
+                          ">>> time.sleep(10)\n")
+        results = run_doctests([slow, self.passing], timeout=0.5)
+        print results
+        assert results[0].error.startswith("timeout")
+        assert results[1].ok
+
+    def test_error(self):
+        missing = os.path.join(self.tmpdir, "missing.py.txt")
+        results = run_doctests([missing])
+        assert results[0].error.startswith("IOError")
+
+    def test_report(self):
+        results = run_doctests([self.passing, self.failing])
+        stream = StringIO()
+        report_doctests(results, stream)
+        report = stream.getvalue()
+        print report
+        assert "Expected:" in report
+        assert report.endswith("1 failures in 2 tests in 2 files\n")
+
+    def test_junit_xml(self):
+        from xml.dom.minidom import parse
+        results = run_doctests([self.passing, self.failing])
+        xmlpath = os.path.join(self.tmpdir, "doctest.xml")
+        write_junit_xml(results, xmlpath)
+        suite = parse(xmlpath).documentElement
+        assert suite.getAttribute("tests") == "2"
+        assert suite.getAttribute("failures") == "1"
+        cases = suite.getElementsByTagName("testcase")
+        assert [case.getAttribute("name") for case in cases] \
+               == [self.passing, self.failing]
+        assert len(cases[1].getElementsByTagName("failure")) == 1
+
+    def test_cache(self):
+        """passed tests are skipped if file and local imports are unchanged"""
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        self.write("litdep.py", "value = 1\n")
+        test = self.write("d.py.txt", ">>> import litdep\n"
+                                      ">>> litdep.value\n1\n")
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            results = run_doctests([test, self.failing], cache_dir=cache_dir)
+            assert "(cached)" not in results[0].output
+            results = run_doctests([test, self.failing], cache_dir=cache_dir)
+            print results[0].output
+            assert "(cached)" in results[0].output
+            assert (results[0].failures, results[0].tries) == (0, 2)
+            assert results[1].failures == 1 # failures are not cached
+            # a changed dependency invalidates the cached result
+            self.write("litdep.py", "value = 2\n")
+            results = run_doctests([test], cache_dir=cache_dir)
+            assert "(cached)" not in results[0].output
+            assert results[0].failures == 1
+        finally:
+            os.chdir(cwd)
+
+    def test_cache_sys_path(self):
+        """modules imported from elsewhere in sys.path are dependencies"""
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        libdir = tempfile.mkdtemp()
+        path = os.path.join(libdir, "litdep2.py")
+        file(path, 'w').write("value = 1\n")
+        test = self.write("d.py.txt", ">>> import litdep2\n"
+                                      ">>> litdep2.value\n1\n")
+        sys.path.insert(0, libdir)
+        try:
+            results = run_doctests([test], cache_dir=cache_dir)
+            results = run_doctests([test], cache_dir=cache_dir)
+            assert "(cached)" in results[0].output
+            file(path, 'w').write("value = 2\n")
+            results = run_doctests([test], cache_dir=cache_dir)
+            assert "(cached)" not in results[0].output
+            assert results[0].failures == 1
+        finally:
+            sys.path.remove(libdir)
+            shutil.rmtree(libdir)
+
+    def test_main(self):
+        os.remove(self.failing)
+        results = main(["--doctest", "--jobs", "2", self.tmpdir])
+        assert [result.infile for result in results] == [self.passing,
+                                                         self.isolated]
+
+    def test_serial_default(self):
+        """without --jobs, the tests run one after the other"""
+        lock = os.path.join(self.tmpdir, "lock")
+        test = (">>> import os, time\n"
+                ">>> os.mkdir(%r) # fails if another test runs\n"
+                ">>> time.sleep(0.3)\n"
+                ">>> os.rmdir(%r)\n" % (lock, lock))
+        infiles = [self.write("d%d.py.txt" % i, test) for i in range(2)]
+        results = main(["--doctest"] + infiles)
+        print results
+        assert [result.ok for result in results] == [True, True]
+        results = run_doctests(infiles, jobs=2)
+        assert [result.ok for result in results] != [True, True]
+
+    def test_negative_jobs(self):
+        try:
+            run_doctests([self.passing], jobs=-1)
+            assert False, "should raise ValueError"
+        except ValueError:
+            pass
+        try:
+            main(["--doctest", "--jobs", "-1", self.passing])
+            assert False, "should exit with usage error"
+        except SystemExit:
+            pass
+
+    def test_main_failure(self):
+        try:
+            main(["--doctest", self.passing, self.failing])
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("should exit with error")
+
 ## The main() function is called if the script is run from the command line
 ## 
 ## ::
@@ -364,6 +630,30 @@ class test_Main(IOTests):
         print repr(output)
         assert output == stripped_code
     
+    def test_text_to_code_mmap(self):
+        main(infile=self.txtpath, outfile=self.outpath, use_mmap=True)
+        assert self.get_output() == code
+
+    def test_text_to_code_profile(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            main(infile=self.txtpath, outfile=self.outpath, profile=True)
+            report = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        assert self.get_output() == code
+        assert "code_block_handler" in report
+        assert "write" in report
+
+    def test_text_to_code_source_map(self):
+        main(infile=self.txtpath, outfile=self.outpath, strip=True,
+             write_source_map=True)
+        assert self.get_output() == stripped_code
+        source_map = SourceMap.parse(file(self.outpath + ".map").read())
+        os.remove(self.outpath + ".map")
+        assert source_map.to_output(1) == 1
+
     def test_text_to_code_twice(self):
         """conversion should work a second time"""
         main(infile=self.txtpath, outfile=self.outpath)
@@ -402,6 +692,30 @@ class test_Main(IOTests):
         print "diff return value", result
         assert result is True # differences found
 
+    def test_check(self):
+        result = main(infile=self.txtpath, outfile=self.codepath, check=True)
+        assert result is False # up to date
+
+    def test_check_with_differences(self):
+        """out of date output files are reported with exit status 1"""
+        file(self.outpath, 'w').write(code + "# more\n")
+        try:
+            main(infile=self.txtpath, outfile=self.outpath, check=True)
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("should exit with error")
+
+    def test_check_missing(self):
+        assert check(self.txtpath, self.outpath) is True
+
+    def test_same_output(self):
+        from pylit import _same_output
+        assert _same_output(["ab", "c\n"], StringIO("abc\n"))
+        assert not _same_output(["ab", "c\n"], StringIO("abd\n"))
+        assert not _same_output(["ab"], StringIO("abc\n"))
+        assert not _same_output(["abc\n", "d"], StringIO("abc\n"))
+
     def test_execute(self):
         result = main(infile=self.txtpath, execute=True)
         print result
@@ -410,6 +724,656 @@ class test_Main(IOTests):
         result = main(infile=self.codepath, execute=True)
 
 
+class test_Verify(IOTests):
+    """test the block-wise round-trip verification"""
+
+    tabbed_code = ["# doc::\n", "\n", "if 1:\n", "\tx = 1\n", "\n",
+                   "# more doc\n"]
+
+    def test_verify_roundtrip(self):
+        assert verify_roundtrip(textdata) is None
+        assert verify_roundtrip(codedata, txt2code=False) is None
+
+    def test_mismatch(self):
+        """tabs are expanded, the round trip changes the code block"""
+        mismatch = verify_roundtrip(self.tabbed_code, txt2code=False)
+        print mismatch
+        assert mismatch.index == 1
+        assert mismatch.state == "code_block"
+        assert (mismatch.start, mismatch.end) == (2, 5)
+        assert mismatch.expected == self.tabbed_code[2:5]
+        assert mismatch.got == ["if 1:\n", "        x = 1\n", "\n"]
+        assert str(mismatch) == ("block 2 (code_block, lines 3-5) changes "
+                                 "in round-trip conversion")
+
+    def test_mismatch_added_marker(self):
+        """the lines of a block in the result are found after added lines"""
+        data = ["# doc\n", "\n", "x = 1\n", "\n", "# more::\n", "\n",
+                "y = 2\n"]
+        mismatch = verify_roundtrip(data, txt2code=False)
+        assert (mismatch.index, mismatch.start, mismatch.end) == (0, 0, 2)
+        assert mismatch.got == ["# doc\n", "# \n", "# ::\n", "\n"]
+
+    def test_verify(self):
+        assert verify(self.txtpath) is False
+        file(self.codepath, 'w').writelines(self.tabbed_code)
+        assert verify(self.codepath, txt2code=False) is True
+
+    def test_main_verify(self):
+        main(infile=self.txtpath, verify=True)
+        file(self.codepath, 'w').writelines(self.tabbed_code)
+        try:
+            main(infile=self.codepath, verify=True)
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("should exit with error")
+
+    def test_diff_roundtrip(self):
+        """diff without outfile does a round-trip conversion"""
+        file(self.codepath, 'w').writelines(self.tabbed_code)
+        assert main(infile=self.codepath, outfile=self.outpath,
+                    diff=True) is True
+        assert main(infile=self.txtpath, outfile=self.outpath,
+                    diff=True) is False
+
+    def test_diff_roundtrip_options(self):
+        """the round-trip diff uses the options in both directions"""
+        file(self.codepath, 'w').write("## doc\n\nx = 1\n")
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            assert diff(self.codepath, txt2code=False,
+                        comment_string="## ") is True
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        print output
+        assert "+## ::\n" in output
+        assert "+# " not in output
+
+
+class test_Recursive(object):
+    """test the batch conversion of all sources in a directory tree"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, "sub"))
+        self.txtpaths = [os.path.join(self.tmpdir, "a.py.txt"),
+                         os.path.join(self.tmpdir, "sub", "b.py.txt")]
+        for path in self.txtpaths:
+            txtfile = file(path, 'w')
+            txtfile.write(text)
+            txtfile.close()
+        # a text file without code extension is no literate source
+        self.readme = os.path.join(self.tmpdir, "README.txt")
+        file(self.readme, 'w').write("just text\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_sources(self):
+        sources = find_sources([self.tmpdir])
+        print sources
+        assert sources == self.txtpaths
+
+    def test_find_sources_code(self):
+        main(["--recursive", self.tmpdir])
+        sources = find_sources([self.tmpdir], txt2code=False)
+        print sources
+        assert sources == [path[:-4] for path in self.txtpaths]
+
+    def test_find_sources_file_arg(self):
+        """files are taken as given"""
+        assert find_sources([self.readme]) == [self.readme]
+
+    def test_main_recursive(self):
+        main(["--recursive", self.tmpdir])
+        for path in self.txtpaths:
+            assert file(path[:-4]).read() == code
+        assert not os.path.exists(self.readme[:-4])
+
+    def test_convert_many(self):
+        failures = convert_many(self.txtpaths, strip=True)
+        assert failures == []
+        for path in self.txtpaths:
+            assert file(path[:-4]).read() == stripped_code
+
+    def test_convert_many_failures(self):
+        """errors are reported without aborting the batch"""
+        missing = os.path.join(self.tmpdir, "missing.py.txt")
+        failures = convert_many([missing] + self.txtpaths)
+        print failures
+        assert [infile for (infile, error) in failures] == [missing]
+        for path in self.txtpaths:
+            assert file(path[:-4]).read() == code
+
+
+    def test_convert_many_jobs(self):
+        failures = convert_many(self.txtpaths, jobs=2)
+        assert failures == []
+        for path in self.txtpaths:
+            assert file(path[:-4]).read() == code
+
+    def test_convert_many_jobs_failures(self):
+        """errors in worker processes are reported"""
+        missing = os.path.join(self.tmpdir, "missing.py.txt")
+        failures = convert_many(self.txtpaths + [missing], jobs=2)
+        print failures
+        assert [infile for (infile, error) in failures] == [missing]
+        assert isinstance(failures[0][1], IOError)
+
+    def test_check_many(self):
+        main(["--recursive", self.tmpdir])
+        assert check_many(self.txtpaths) == []
+        file(self.txtpaths[1], 'a').write("more text\n")
+        assert check_many(self.txtpaths) == [self.txtpaths[1]]
+
+    def test_main_check(self):
+        main(["--recursive", self.tmpdir])
+        main(["--check", self.tmpdir])
+        os.remove(self.txtpaths[0][:-4])
+        try:
+            main(["--check", self.tmpdir])
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("should exit with error")
+
+    def test_main_verify(self):
+        assert main(["--verify", self.tmpdir]) == []
+
+    def test_main_jobs(self):
+        main(["--recursive", "--jobs", "2", self.tmpdir])
+        for path in self.txtpaths:
+            assert file(path[:-4]).read() == code
+
+
+class test_Watcher(object):
+    """test keeping text and code versions in sync"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.txtpath = os.path.join(self.tmpdir, "a.py.txt")
+        self.codepath = os.path.join(self.tmpdir, "a.py")
+        self.touch(self.txtpath, text, 100)
+        file(os.path.join(self.tmpdir, "README.txt"), 'w').write("text\n")
+        self.watcher = Watcher([self.tmpdir], delay=1.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, path, content, mtime):
+        file(path, 'w').write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_pairs(self):
+        assert self.watcher.pairs() == [(self.txtpath, self.codepath)]
+
+    def test_pairs_code_source(self):
+        """code files are watched if the text version exists"""
+        os.remove(self.txtpath)
+        file(self.codepath, 'w').write(code)
+        assert self.watcher.pairs() == []
+        assert Watcher([self.codepath]).pairs() == [(self.txtpath,
+                                                     self.codepath)]
+
+    def test_initial_sync(self):
+        assert self.watcher.check(now=0) == [self.txtpath]
+        assert file(self.codepath).read() == code
+        # the pair is in sync now
+        assert self.watcher.check(now=10) == []
+
+    def test_debounce(self):
+        self.watcher.check(now=0)
+        self.touch(self.codepath, code + "# new\n", 1000)
+        assert self.watcher.check(now=10) == []
+        assert self.watcher.check(now=10.5) == []
+        assert self.watcher.check(now=11) == [self.codepath]
+        assert file(self.txtpath).read().endswith("new\n")
+        assert self.watcher.check(now=20) == []
+
+    def test_debounce_restart(self):
+        """changes during the delay restart it"""
+        self.watcher.check(now=0)
+        self.touch(self.txtpath, text, 1000)
+        assert self.watcher.check(now=10) == []
+        self.touch(self.txtpath, text + "more text\n", 1001)
+        assert self.watcher.check(now=10.5) == []
+        assert self.watcher.check(now=11) == []
+        assert self.watcher.check(now=11.5) == [self.txtpath]
+
+    def test_deleted_file(self):
+        """deleted files are not restored from the other version"""
+        self.watcher.check(now=0)
+        os.remove(self.txtpath)
+        assert self.watcher.check(now=10) == []
+        assert self.watcher.check(now=20) == []
+        assert not os.path.exists(self.txtpath)
+
+
+class test_ConversionCache(IOTests):
+    """test the content-hash based conversion cache"""
+
+    def setUp(self):
+        IOTests.setUp(self)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        IOTests.tearDown(self)
+        shutil.rmtree(self.cache_dir)
+
+    def test_key(self):
+        cache = ConversionCache(self.cache_dir)
+        key = cache.key([text], Text2Code(textdata))
+        assert key == cache.key(textdata, Text2Code(textdata))
+        assert key != cache.key([text], Text2Code(textdata, strip=True))
+        assert key != cache.key([text], Text2Code(textdata, codeindent=4))
+        assert key != cache.key([text, "\n"], Text2Code(textdata))
+
+    def test_get_put(self):
+        cache = ConversionCache(self.cache_dir)
+        assert cache.get("foo") is None
+        cache.put("foo", code)
+        assert cache.get("foo") == code
+
+    def test_put_error(self):
+        """a failing conversion leaves no (temporary) cache entry"""
+        cache = ConversionCache(self.cache_dir)
+        converter = Text2Code(["..    #!/usr/bin/env python\n", "\n",
+                               "  print 'hello world'\n"])
+        try:
+            cache.put("foo", converter)
+            assert False, "wrong indent did not raise ValueError"
+        except ValueError:
+            pass
+        assert cache.get("foo") is None
+        assert os.listdir(self.cache_dir) == []
+
+    def test_convert(self):
+        main(infile=self.txtpath, outfile=self.outpath,
+             cache_dir=self.cache_dir)
+        assert self.get_output() == code
+        assert len(os.listdir(self.cache_dir)) == 1
+
+    def test_ignore_mtime(self):
+        """an up-to-date outfile is kept even if it is newer than infile"""
+        main(infile=self.txtpath, outfile=self.outpath,
+             cache_dir=self.cache_dir)
+        os.utime(self.outpath, (0, os.path.getmtime(self.txtpath) + 10))
+        main(infile=self.txtpath, outfile=self.outpath,
+             cache_dir=self.cache_dir)
+        assert not is_newer(self.outpath, self.txtpath)
+
+    def test_restore_from_cache(self):
+        """a cache hit skips the conversion"""
+        cache = ConversionCache(self.cache_dir)
+        key = cache.key([text], Text2Code(textdata))
+        cache.put(key, "cached output\n")
+        main(infile=self.txtpath, outfile=self.outpath,
+             cache_dir=self.cache_dir)
+        assert self.get_output() == "cached output\n"
+
+
+class test_ConversionServer(object):
+    """test the JSON-RPC conversion server"""
+
+    def setUp(self):
+        self.server = ConversionServer()
+        self.json = self.server.json
+
+    def call(self, method, **params):
+        request = {"jsonrpc": "2.0", "id": 1, "method": method,
+                   "params": params}
+        response = self.json.loads(self.server.handle(self.json.dumps(request)))
+        assert response["id"] == 1
+        return response.get("result", response.get("error"))
+
+    def test_convert(self):
+        result = self.call("convert", text=text, txt2code=True)
+        assert result == {"output": code, "txt2code": True}
+
+    def test_convert_filename(self):
+        """the direction is guessed from the filename"""
+        result = self.call("convert", text=code, filename="foo.py")
+        assert result == {"output": text, "txt2code": False}
+
+    def test_diff(self):
+        result = self.call("diff", text=text, output=code, txt2code=True)
+        assert result == {"different": False, "diff": ""}
+        result = self.call("diff", text=text, output=code+"x\n",
+                           txt2code=True)
+        assert result["different"]
+        assert "-x" in result["diff"]
+
+    def test_diff_roundtrip(self):
+        result = self.call("diff", text=text, txt2code=True)
+        assert result == {"different": False, "diff": ""}
+
+    def test_check(self):
+        assert self.call("check", text=code, output=text, txt2code=False) \
+               == {"up_to_date": True}
+        assert self.call("check", text=code, output="", txt2code=False) \
+               == {"up_to_date": False}
+
+    def test_doctest(self):
+        result = self.call("doctest", text=">>> 1 + 1\n3\n")
+        assert (result["failures"], result["tries"]) == (1, 1)
+        assert "Expected:" in result["output"]
+
+    def test_errors(self):
+        assert self.call("no_such_method")["code"] == -32601
+        assert self.call("convert")["code"] == -32602
+        assert "missing text" in self.call("convert")["message"]
+        response = self.json.loads(self.server.handle("no json"))
+        assert response["error"]["code"] == -32700
+
+    def test_internal_type_error(self):
+        """a TypeError inside a method is no "Invalid params" error"""
+        class Server(ConversionServer):
+            def rpc_fail(self, text):
+                return len(None)
+        self.server = Server()
+        assert self.call("fail", text="")["code"] == -32000
+        assert self.call("fail")["code"] == -32602
+        assert self.call("fail", text="", foo=1)["code"] == -32602
+
+    def test_doctest_unicode(self):
+        result = self.call("doctest", text=u"# >>> len(u'caf\xe9')\n# 4\n",
+                           txt2code=False)
+        assert (result["failures"], result["tries"]) == (0, 1)
+
+    def test_notification(self):
+        """requests without id get no response"""
+        request = {"jsonrpc": "2.0", "method": "convert",
+                   "params": {"text": text}}
+        assert self.server.handle(self.json.dumps(request)) is None
+        request = {"jsonrpc": "2.0", "method": "convert"}
+        assert self.server.handle(self.json.dumps(request)) is None
+        request = {"jsonrpc": "2.0", "method": "no_such_method"}
+        assert self.server.handle(self.json.dumps(request)) is None
+
+    def test_serve(self):
+        requests = [{"jsonrpc": "2.0", "id": 1, "method": "convert",
+                     "params": {"text": text, "txt2code": True}},
+                    {"jsonrpc": "2.0", "id": 2, "method": "check",
+                     "params": {"text": text, "output": code}}]
+        instream = StringIO("".join([self.json.dumps(request) + "\n"
+                                     for request in requests]))
+        outstream = StringIO()
+        self.server.serve(instream, outstream)
+        responses = [self.json.loads(line)
+                     for line in outstream.getvalue().splitlines()]
+        assert [response["id"] for response in responses] == [1, 2]
+        assert responses[0]["result"]["output"] == code
+        assert responses[1]["result"]["up_to_date"]
+
+    def test_socket(self):
+        import socket, threading
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "pylit.socket")
+        server = self.server.socket_server(path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            stream = client.makefile("rw")
+            stream.write(self.json.dumps({"jsonrpc": "2.0", "id": 7,
+                "method": "convert",
+                "params": {"text": text, "txt2code": True}}) + "\n")
+            stream.flush()
+            response = self.json.loads(stream.readline())
+            stream.close()
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(tmpdir)
+        assert response["result"]["output"] == code
+
+    def test_socket_concurrent_doctests(self):
+        """doctests of concurrent clients do not mix their output"""
+        import socket, threading
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "pylit.socket")
+        server = self.server.socket_server(path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        responses = {}
+        def client(name):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(path)
+            stream = connection.makefile("rw")
+            stream.write(self.json.dumps({"jsonrpc": "2.0", "id": name,
+                "method": "doctest",
+                "params": {"text": ">>> import time; time.sleep(0.2)\n"
+                                   ">>> print %r\n%s\n" % (name, name)}})
+                         + "\n")
+            stream.flush()
+            responses[name] = self.json.loads(stream.readline())
+            stream.close()
+            connection.close()
+        clients = [threading.Thread(target=client, args=(name,))
+                   for name in ("a", "b")]
+        try:
+            for client_thread in clients:
+                client_thread.start()
+            for client_thread in clients:
+                client_thread.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(tmpdir)
+        print responses
+        for name in ("a", "b"):
+            result = responses[name]["result"]
+            assert (result["failures"], result["tries"]) == (0, 2)
+
+
+class test_ImportHook(object):
+    """test the import of literate modules"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.txtpath = os.path.join(self.tmpdir, "litmod.py.txt")
+        self.write(self.txtpath, "Value::\n\n  value = 1\n")
+        os.mkdir(os.path.join(self.tmpdir, "litpkg"))
+        self.write(os.path.join(self.tmpdir, "litpkg", "__init__.py.txt"),
+                   "Package::\n\n  from litpkg import sub\n")
+        self.write(os.path.join(self.tmpdir, "litpkg", "sub.py.txt"),
+                   "Submodule::\n\n  value = 'sub'\n")
+        sys.path.insert(0, self.tmpdir)
+        self.importer = install_import_hook()
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+
+    def tearDown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        uninstall_import_hook()
+        sys.path.remove(self.tmpdir)
+        for name in ("litmod", "litpkg", "litpkg.sub"):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, content):
+        stream = file(path, 'w')
+        stream.write(content)
+        stream.close()
+
+    def test_install(self):
+        assert self.importer in sys.meta_path
+        assert install_import_hook() is self.importer
+        uninstall_import_hook()
+        assert self.importer not in sys.meta_path
+
+    def test_import(self):
+        import litmod
+        assert litmod.value == 1
+        assert litmod.__file__ == self.txtpath
+        cache_file = os.path.join(self.tmpdir, "__pycache__",
+                                  "litmod.py.txt.pyc")
+        assert os.path.exists(cache_file)
+
+    def test_import_package(self):
+        import litpkg
+        assert litpkg.sub.value == "sub"
+        assert litpkg.__path__ == [os.path.join(self.tmpdir, "litpkg")]
+
+    def test_regular_module_first(self):
+        """a code source in the same directory takes precedence"""
+        self.write(os.path.join(self.tmpdir, "litmod.py"), "value = 2\n")
+        import litmod
+        assert litmod.value == 2
+
+    def test_unknown_module(self):
+        assert self.importer.find_module("no_such_litmod") is None
+
+    def test_compile_text_cached(self):
+        """a cache hit skips conversion and compilation"""
+        compile_text(self.txtpath)
+        import pylit
+        def compile(*args):
+            raise AssertionError("should load the cached code")
+        pylit.compile = compile
+        try:
+            namespace = {}
+            exec compile_text(self.txtpath) in namespace
+        finally:
+            del(pylit.compile)
+        assert namespace["value"] == 1
+
+    def test_compile_text_changed(self):
+        """changes to the source invalidate the cached code"""
+        compile_text(self.txtpath)
+        self.write(self.txtpath, "Value::\n\n  value = 3\n")
+        namespace = {}
+        exec compile_text(self.txtpath) in namespace
+        assert namespace["value"] == 3
+
+    def test_compile_text_cache_dir(self):
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        code = compile_text(self.txtpath, cache_dir=cache_dir)
+        assert code.co_filename == self.txtpath
+        assert len(os.listdir(cache_dir)) == 1
+
+    def test_execute(self):
+        """scripts run in a new namespace as __main__"""
+        self.write(self.txtpath, "Script::\n\n"
+                   "  assert __name__ == '__main__'\n"
+                   "  assert 'keyw' not in dir()\n")
+        main(infile=self.txtpath, execute=True)
+        # nothing is written without --cache-dir
+        assert not os.path.exists(os.path.join(self.tmpdir, "__pycache__"))
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        main(["--execute", "--cache-dir", cache_dir, self.txtpath])
+        assert len(os.listdir(cache_dir)) == 1
+
+    def test_execute_traceback(self):
+        """tracebacks show the name and line of the text source"""
+        self.write(self.txtpath, "Script::\n\n  raise ValueError\n")
+        try:
+            execute(self.txtpath)
+        except ValueError:
+            tb = sys.exc_info()[2]
+            while tb.tb_next:
+                tb = tb.tb_next
+            assert tb.tb_frame.f_code.co_filename == self.txtpath
+            assert tb.tb_lineno == 3
+        else:
+            raise AssertionError("should raise ValueError")
+
+    def test_dont_write_bytecode(self):
+        sys.dont_write_bytecode = True
+        compile_text(self.txtpath)
+        assert not os.path.exists(os.path.join(self.tmpdir, "__pycache__"))
+
+
+## Plug-ins
+## ========
+##
+## ::
+
+class test_Plugins(object):
+    """Language plug-ins are only imported when used"""
+    def setUp(self):
+        import pylit
+        self.pylit = pylit
+        self.saved = (dict(defaults.plugins), defaults.plugin_path,
+                      pylit._plugins_discovered)
+        self.tmpdir = tempfile.mkdtemp()
+        stream = file(os.path.join(self.tmpdir, "pylit_testplug.py"), "w")
+        stream.write("# pylit-extensions: .tp\n"
+                     "import pylit\n"
+                     "pylit.register_language('testplug', ['.tp'], '%% ')\n")
+        stream.close()
+        defaults.plugin_path = [self.tmpdir]
+        pylit._plugins_discovered = False
+
+    def tearDown(self):
+        (plugins, defaults.plugin_path,
+         self.pylit._plugins_discovered) = self.saved
+        defaults.plugins.clear()
+        defaults.plugins.update(plugins)
+        for plugin in self.pylit._plugin_modules.keys():
+            if plugin.startswith(self.tmpdir):
+                del(self.pylit._plugin_modules[plugin])
+        defaults.languages.pop(".tp", None)
+        defaults.comment_strings.pop("testplug", None)
+        sys.modules.pop("pylit_testplug", None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_loaded(self):
+        assert "pylit_testplug" not in sys.modules
+        assert "testplug" not in defaults.comment_strings
+
+    def test_load_by_language(self):
+        """a converter for the language loads its plug-in"""
+        converter = Code2Text(["%% text\n"], language="testplug")
+        assert converter.comment_string == "%% "
+        assert "pylit_testplug" in sys.modules
+
+    def test_load_by_extension(self):
+        values = PylitOptions()(["foo.tp"])
+        assert values.language == "testplug"
+        assert values.txt2code is False
+
+    def test_language_option(self):
+        values = PylitOptions().parse_args(["--language", "testplug"])
+        assert values.language == "testplug"
+        assert defaults.comment_strings["testplug"] == "%% "
+        try:
+            PylitOptions().parse_args(["--language", "no_such_language"])
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("should reject unknown language")
+
+    def test_language_option_languages_default(self):
+        """languages given as option default are valid choices"""
+        languages = {".foo": "foolang"}
+        values = PylitOptions().parse_args(["--language", "foolang"],
+                                           languages=languages)
+        assert values.language == "foolang"
+        assert "foolang" not in defaults.languages.values()
+
+    def test_registered_plugin_first(self):
+        """registered plug-ins are used without searching"""
+        defaults.plugins["testplug"] = os.path.join(self.tmpdir,
+                                                    "pylit_testplug.py")
+        assert load_plugin("testplug") is True
+        assert self.pylit._plugins_discovered is False
+
+    def test_missing_plugin(self):
+        """plug-ins that cannot be imported are replaced by found ones"""
+        defaults.plugins["testplug"] = "no_such_plugin_module"
+        assert load_plugin("testplug") is True
+        assert self.pylit._plugins_discovered is True
+        assert load_plugin("no_such_language") is False
+
+
 class test_Programmatic_Use(IOTests):
     """test various aspects of programmatic use"""
     
@@ -423,6 +1387,12 @@ class test_Programmatic_Use(IOTests):
         # lines = converter()
         assert lines == codedata
 
+    def test_convert_stream(self):
+        out_stream = file(self.outpath, 'w')
+        convert_stream(file(self.txtpath), out_stream)
+        out_stream.close()
+        assert self.get_output() == code
+
 
 if __name__ == "__main__":
     nose.runmodule() # requires nose 0.9.1